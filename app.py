@@ -1,78 +1,185 @@
+import time
+# Taken first so the startup breakdown includes importing the modules below
+BOOT_STARTED = time.perf_counter()
+
 from flask import Flask, render_template, request, jsonify, Response
-from rag_phi3 import RAGChain
+from metrics import CONTENT_TYPE, metrics_from_env, run_config
+from prompt_builder import CHAT_TEMPLATE, PromptTooLong, builder_from_env
+from quiz_bank import bank_from_env
+from quiz_sessions import store_from_env
+from response_cache import cache_from_env, exact_terms, normalize_query
+from scheduler import (PRIORITY_BACKGROUND, PRIORITY_CHAT, PRIORITY_GRADING, PRIORITY_QUIZ, QueueFull,
+                       QueueTimeout, controller_from_env)
+from startup import NotReady, Startup
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 import random
 import os
 
 app = Flask(__name__)
 
-# Initialize RAG chain with default model (lowercase to match available models)
-rag_chain = RAGChain(model_name="phi")
+# Default model (lowercase to match available models)
+DEFAULT_MODEL = "phi"
 
 # Available models
 AVAILABLE_MODELS = ["phi", "smol", "gemma"]
 
+# Per-stage latency histograms of every route, served at /metrics
+stage_metrics = metrics_from_env()
+
+def init_rag_chain():
+    # Imported here: chromadb, sentence-transformers and langchain take seconds to import
+    from rag_phi3 import RAGChain
+    return RAGChain(model_name=DEFAULT_MODEL)
+
+def init_models():
+    from model_registry import registry_from_env
+    return registry_from_env(AVAILABLE_MODELS, stage_metrics)
+
+def init_lexical_index():
+    chain = get_rag_chain()
+    if chain.retrieval_mode == "hybrid":
+        return chain.lexical_index()
+
+# The vector store, embedding model and Ollama clients are set up on a background
+# thread, so the server starts listening (and answering /healthz) straight away
+startup = Startup(BOOT_STARTED)
+startup.add("rag_chain", init_rag_chain)
+startup.add("models", init_models)
+startup.add("lexical_index", init_lexical_index)
+startup.start()
+
+def get_rag_chain():
+    """The shared RAGChain used for retrieval; raises NotReady while the app is starting"""
+    return startup.get("rag_chain")
+
+def get_models():
+    """The ModelRegistry with a client per model; raises NotReady while the app is starting"""
+    return startup.get("models")
+
+# Answers to semantically equivalent questions over the same passages are reused
+response_cache = cache_from_env()
+
+# Every Ollama generation goes through the scheduler, which bounds concurrency per model
+scheduler = controller_from_env()
+
+# Retrieved passages are packed into a token budget that fits the models' context window
+prompt_builder = builder_from_env()
+
+def sse(payload):
+    """Format one server-sent event the way static/script.js reads them"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+def chunk_to_text(chunk):
+    """Text of a streamed chunk, which may be a string or a langchain-style dict"""
+    if isinstance(chunk, dict):
+        return chunk.get('content', chunk.get('text', str(chunk)))
+    return str(chunk)
+
+def log_prompt(route, model, prompt):
+    """Print and record the size of a prompt, to tune the budget against time-to-first-token"""
+    note = " (last passage trimmed)" if prompt.trimmed else ""
+    print(f"{route} prompt for {model}: {prompt.tokens} tokens, "
+          f"{prompt.passages_used}/{prompt.passages_total} passages{note}")
+    stage_metrics.observe("rag_prompt_tokens", prompt.tokens, route=route, model=model)
+
+def prepare_chat(query, model):
+    """Retrieve passages for a chat query and check the response cache
+
+    Returns (cached_answer, prompt, store): cached_answer is None on a miss,
+    prompt is a prompt_builder.Prompt (use prompt.text), and store(answer)
+    caches a finished answer for this query and passages.
+    """
+    with stage_metrics.timer("rag_retrieval_seconds", route="chat", model=model):
+        doc_ids, retrieved_docs = get_rag_chain().retrieve_with_ids(query, top_k=2)
+    query_embedding = get_rag_chain().embed_query(query)
+    cache_key = ('chat', model, exact_terms(query))
+    cached = response_cache.lookup(cache_key, doc_ids, query_embedding)
+    
+    def store(answer):
+        response_cache.store(cache_key, doc_ids, query_embedding, answer)
+    
+    prompt = prompt_builder.build(CHAT_TEMPLATE, retrieved_docs, model, query=query)
+    if cached is None:
+        log_prompt("chat", model, prompt)
+    return cached, prompt, store
+
 @app.route('/')
 def index():
-    return render_template('index.html', models=AVAILABLE_MODELS, current_model=rag_chain.model_name)
+    return render_template('index.html', models=AVAILABLE_MODELS, current_model=DEFAULT_MODEL)
 
 @app.route('/chat', methods=['POST'])
 def chat():
     data = request.json
     query = data.get('query', '').strip()
-    model = data.get('model', rag_chain.model_name)
+    model = data.get('model') or DEFAULT_MODEL
     stream = data.get('stream', True)  # Default to streaming
     
     if not query:
         return jsonify({'error': 'Query cannot be empty'}), 400
     
-    # Switch model if different from current
-    if model != rag_chain.model_name:
-        rag_chain.switch_model(model)
+    if model not in AVAILABLE_MODELS:
+        return jsonify({'error': f'Model {model} not available'}), 400
     
     if stream:
         # Return streaming response
         def generate():
             try:
                 # Get response from RAG chain
-                retrieved_docs = rag_chain.retrieve(query, top_k=2)
-                context = "\n".join(retrieved_docs)
-                prompt = f"Use the following context to answer the question concisely. Context: {context} \n Question: {query} \nAnswer:"
+                cached, prompt, store = prepare_chat(query, model)
+                llm = get_models().get(model)
+                if cached is not None:
+                    # Replay the cached answer in the same event format as a live stream
+                    yield sse({'chunk': cached, 'done': False})
+                    yield sse({'chunk': '', 'done': True, 'model': model, 'cached': True})
+                    return
+
+                answer_parts = []
                 
-                # Stream response
+                # Wait for a generation slot, telling the page its place in the queue
+                ticket = scheduler.enqueue(model, PRIORITY_CHAT)
                 try:
-                    chunk_count = 0
-                    for chunk in rag_chain.ollama.stream(prompt):
-                        chunk_count += 1
-                        # Handle different chunk formats (string or dict)
-                        if isinstance(chunk, dict):
-                            # Extract text from dict if it's a langchain format
-                            chunk_text = chunk.get('content', chunk.get('text', str(chunk)))
-                        else:
-                            chunk_text = str(chunk)
+                    for position in ticket.positions():
+                        yield sse({'queued': True, 'position': position, 'done': False})
+                    
+                    # Stream response
+                    try:
+                        chunk_count = 0
+                        for chunk in llm.stream(prompt.text, config=run_config('chat')):
+                            chunk_count += 1
+                            chunk_text = chunk_to_text(chunk)
                         
-                        if chunk_text:
-                            # Send each chunk as JSON
-                            yield f"data: {json.dumps({'chunk': chunk_text, 'done': False})}\n\n"
+                            if chunk_text:
+                                answer_parts.append(chunk_text)
+                                # Send each chunk as JSON
+                                yield sse({'chunk': chunk_text, 'done': False})
                     
-                    if chunk_count == 0:
-                        # No chunks received, fallback to non-streaming
-                        print("No chunks received from stream, using invoke instead")
-                        response = rag_chain.ollama.invoke(prompt)
-                        yield f"data: {json.dumps({'chunk': str(response), 'done': False})}\n\n"
-                except (AttributeError, TypeError) as e:
-                    # Fallback if streaming not supported
-                    print(f"Streaming error: {e}, falling back to non-streaming")
-                    response = rag_chain.ollama.invoke(prompt)
-                    yield f"data: {json.dumps({'chunk': str(response), 'done': False})}\n\n"
+                        if chunk_count == 0:
+                            # No chunks received, fallback to non-streaming
+                            print("No chunks received from stream, using invoke instead")
+                            response = llm.invoke(prompt.text, config=run_config('chat'))
+                            answer_parts.append(str(response))
+                            yield sse({'chunk': str(response), 'done': False})
+                    except (AttributeError, TypeError) as e:
+                        # Fallback if streaming not supported
+                        print(f"Streaming error: {e}, falling back to non-streaming")
+                        response = llm.invoke(prompt.text, config=run_config('chat'))
+                        answer_parts.append(str(response))
+                        yield sse({'chunk': str(response), 'done': False})
+                finally:
+                    # Also runs when the client disconnects mid-stream (GeneratorExit)
+                    ticket.release()
+                
+                # Only reached when the whole answer was sent, so partial answers are never cached
+                store(''.join(answer_parts))
                 
                 # Send final message with model info
-                yield f"data: {json.dumps({'chunk': '', 'done': True, 'model': rag_chain.model_name})}\n\n"
+                yield sse({'chunk': '', 'done': True, 'model': model, 'prompt_tokens': prompt.tokens})
             except Exception as e:
                 import traceback
                 error_msg = f"{str(e)}\n{traceback.format_exc()}"
                 print(f"Error in generate(): {error_msg}")
-                yield f"data: {json.dumps({'error': str(e), 'done': True})}\n\n"
+                yield sse({'error': str(e), 'done': True})
         
         response = Response(generate(), mimetype='text/event-stream')
         response.headers['Cache-Control'] = 'no-cache'
@@ -81,102 +188,127 @@ def chat():
     else:
         # Non-streaming fallback
         try:
-            retrieved_docs = rag_chain.retrieve(query, top_k=2)
-            context = "\n".join(retrieved_docs)
-            prompt = f"Use the following context to answer the question concisely. Context: {context} \n Question: {query} \nAnswer:"
+            cached, prompt, store = prepare_chat(query, model)
+            if cached is not None:
+                return jsonify({
+                    'response': cached,
+                    'model': model,
+                    'cached': True
+                })
             
-            response = rag_chain.ollama.invoke(prompt)
+            llm = get_models().get(model)
+            with scheduler.slot(model, PRIORITY_CHAT):
+                response = llm.invoke(prompt.text, config=run_config('chat'))
+            store(response)
             
             return jsonify({
                 'response': response,
-                'model': rag_chain.model_name
+                'model': model,
+                'prompt_tokens': prompt.tokens
             })
+        except PromptTooLong as e:
+            return jsonify({'error': str(e)}), 400
+        except (QueueFull, QueueTimeout, NotReady) as e:
+            return jsonify({'error': str(e)}), 503
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
 @app.route('/switch_model', methods=['POST'])
 def switch_model():
     data = request.json
-    model = data.get('model', 'phi')
+    model = data.get('model', DEFAULT_MODEL)
     
     if model not in AVAILABLE_MODELS:
         return jsonify({'error': f'Model {model} not available'}), 400
     
-    try:
-        rag_chain.switch_model(model)
-        return jsonify({
-            'success': True,
-            'model': rag_chain.model_name,
-            'message': f'Switched to model: {rag_chain.model_name}'
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    # Models are chosen per request, so there is no shared state to change here;
+    # the page keeps the selection and sends it with every request
+    return jsonify({
+        'success': True,
+        'model': model,
+        'message': f'Switched to model: {model}'
+    })
 
 @app.route('/current_model', methods=['GET'])
 def current_model():
-    return jsonify({'model': rag_chain.model_name})
+    return jsonify({'model': DEFAULT_MODEL})
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'responses': response_cache.stats(),
+        'quiz_bank': question_bank.stats(),
+        'query_embeddings': get_rag_chain().query_cache_info()._asdict() if startup.ready() else None
+    })
+
+@app.route('/queue_stats', methods=['GET'])
+def queue_stats():
+    return jsonify(scheduler.stats())
+
+@app.route('/model_stats', methods=['GET'])
+def model_stats():
+    try:
+        return jsonify(get_models().stats())
+    except NotReady as e:
+        return jsonify({'error': str(e)}), 503
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness only: the process is up and serving requests, even while still starting
+    return jsonify({'status': 'ok', 'uptime_seconds': round(time.perf_counter() - BOOT_STARTED, 1)})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Ready once the vector store, embedding model and model clients are set up
+
+    Also reports which models Ollama has in memory (null if Ollama cannot be
+    reached) and how many passages are indexed; these do not affect readiness.
+    """
+    ready = startup.ready()
+    body = {'ready': ready, 'steps': startup.status(), 'models': None, 'passages': None}
+    if ready:
+        body['models'] = get_models().loaded()
+        body['passages'] = get_rag_chain().collection.count()
+    return jsonify(body), 200 if ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if not stage_metrics.enabled:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(stage_metrics.render(), content_type=CONTENT_TYPE)
 
 @app.route('/quiz')
 def quiz():
-    return render_template('quiz.html', models=AVAILABLE_MODELS, current_model=rag_chain.model_name)
+    return render_template('quiz.html', models=AVAILABLE_MODELS, current_model=DEFAULT_MODEL)
 
-@app.route('/generate_question', methods=['POST'])
-def generate_question():
-    data = request.json
-    model = data.get('model', rag_chain.model_name)
-    topic = data.get('topic', '').strip()
-    
-    # Switch model if different from current
-    if model != rag_chain.model_name:
-        rag_chain.switch_model(model)
-    
-    try:
-        # Retrieve relevant course material
-        if topic:
-            # Use topic to retrieve relevant material
-            # Vary top_k slightly for variation (2-4)
-            top_k = random.randint(2, 4)
-            retrieved_docs = rag_chain.retrieve(topic, top_k=top_k)
-        else:
-            # Retrieve random material if no topic specified
-            # Vary top_k and use different query variations
-            top_k = random.randint(2, 4)
-            query_variations = [
-                "course material",
-                "mathematics concepts",
-                "key topics",
-                "important concepts",
-                "learning material"
-            ]
-            query = random.choice(query_variations)
-            retrieved_docs = rag_chain.retrieve(query, top_k=top_k)
-        
-        context = "\n".join(retrieved_docs)
-        
-        # Vary question types and styles for diversity
-        question_styles = [
-            "application-based question",
-            "conceptual understanding question",
-            "problem-solving question",
-            "explanation question",
-            "analysis question"
-        ]
-        question_approaches = [
-            "asks students to explain",
-            "requires students to calculate",
-            "asks students to compare",
-            "requires students to apply",
-            "asks students to demonstrate understanding of"
-        ]
-        
-        selected_style = random.choice(question_styles)
-        selected_approach = random.choice(question_approaches)
-        
-        # Generate a question based on the context with variation
-        prompt = f"""Based on the following course material, generate a single, clear, and specific {selected_style} that {selected_approach} the key concepts.
+# Vary question types and styles for diversity
+QUESTION_STYLES = [
+    "application-based question",
+    "conceptual understanding question",
+    "problem-solving question",
+    "explanation question",
+    "analysis question"
+]
+QUESTION_APPROACHES = [
+    "asks students to explain",
+    "requires students to calculate",
+    "asks students to compare",
+    "requires students to apply",
+    "asks students to demonstrate understanding of"
+]
+# Used to retrieve random material if no topic is specified
+QUERY_VARIATIONS = [
+    "course material",
+    "mathematics concepts",
+    "key topics",
+    "important concepts",
+    "learning material"
+]
 
-Course Material:
-{context}
+# Prompts keep their fixed instructions first and the parts that vary per request
+# (material, style, question, answer) last, so consecutive requests share a long
+# prefix that Ollama can reuse from its KV cache instead of evaluating again
+QUESTION_TEMPLATE = """Based on the course material below, generate a single, clear, and specific question.
 
 Generate a question that:
 1. Tests understanding of important concepts from the material
@@ -187,73 +319,294 @@ Generate a question that:
 
 Make sure the question is unique and tests a different aspect or uses different wording than typical questions.
 
+Course Material:
+{context}
+
+Write it as a {style} that {approach} the key concepts.
+
 Question:"""
+
+GRADING_TEMPLATE = """You are a teacher evaluating a student's answer. Based on the course material provided, provide feedback on the student's answer.
+
+Provide a brief explanation (2-3 sentences) evaluating the answer. If the answer is incorrect or partially correct, explain what the correct answer should include.
+
+Course Material:
+{context}
+
+Question: {question}
+
+Student's Answer: {answer}
+"""
+
+def create_question(model, topic, priority=PRIORITY_QUIZ, use_cache=True):
+    """Retrieve course material and have the model write a question about it
+
+    Returns a dict with the question, the ids of the retrieved passages and
+    their text as context. Raises QueueFull/QueueTimeout if no slot is free.
+    With use_cache=False the response cache is neither read nor written, so
+    the question bank's pre-generated questions never replace cached ones.
+    """
+    # Pre-generated questions are recorded apart from the ones a student waits for
+    route = 'question_bank' if priority == PRIORITY_BACKGROUND else 'question'
+    
+    # Vary top_k slightly for variation (2-4), and the query too if there is no topic
+    top_k = random.randint(2, 4)
+    query = topic or random.choice(QUERY_VARIATIONS)
+    with stage_metrics.timer("rag_retrieval_seconds", route=route, model=model):
+        doc_ids, retrieved_docs = get_rag_chain().retrieve_with_ids(query, top_k=top_k)
+    
+    selected_style = random.choice(QUESTION_STYLES)
+    selected_approach = random.choice(QUESTION_APPROACHES)
+    
+    # Generate a question based on the context with variation. The packed
+    # context is also what the answer is graded against
+    prompt = prompt_builder.build(
+        QUESTION_TEMPLATE, retrieved_docs, model, style=selected_style, approach=selected_approach
+    )
+    context = prompt.context
+    
+    # The style and approach are part of the key, so cached questions keep their variety
+    cache_key = ('question', model, selected_style, selected_approach, exact_terms(query))
+    query_embedding = get_rag_chain().embed_query(query)
+    if use_cache:
+        cached = response_cache.lookup(cache_key, doc_ids, query_embedding)
+        if cached is not None:
+            return {'question': cached, 'doc_ids': doc_ids, 'context': context}
+    
+    log_prompt(route, model, prompt)
+    
+    # The quiz client uses a higher temperature for more variation in questions
+    question_model = get_models().get(model, 'quiz')
+    
+    with scheduler.slot(model, priority):
+        response = question_model.invoke(prompt.text, config=run_config(route))
+    if use_cache:
+        response_cache.store(cache_key, doc_ids, query_embedding, response.strip())
+    
+    return {'question': response.strip(), 'doc_ids': doc_ids, 'context': context}
+
+# Asked questions and their context stay on the server; the page only holds a token
+quiz_sessions = store_from_env()
+
+# Questions are pre-generated per (model, topic) in the background at the lowest priority
+question_bank = bank_from_env(
+    lambda key: create_question(key[0], key[1], PRIORITY_BACKGROUND, use_cache=False),
+    lambda text: get_rag_chain().embedder.encode([text])[0]
+)
+
+@app.route('/generate_question', methods=['POST'])
+def generate_question():
+    data = request.json
+    model = data.get('model') or DEFAULT_MODEL
+    topic = data.get('topic', '').strip()
+    
+    if model not in AVAILABLE_MODELS:
+        return jsonify({'error': f'Model {model} not available'}), 400
+    
+    try:
+        key = (model, normalize_query(topic))
+        entry = question_bank.take(key)
+        if entry is None:
+            # Nothing pooled for this topic yet: generate one now while the pool refills
+            entry = create_question(model, topic)
+            question_bank.note_served(key, entry['question'])
         
-        # Temporarily increase temperature for more variation in question generation
-        # Save original temperature if it exists
-        original_temp = getattr(rag_chain.ollama, 'temperature', None)
-        
-        # Create a temporary Ollama instance with higher temperature for question generation
-        from langchain_community.llms import Ollama
-        question_model = Ollama(model=rag_chain.model_name, temperature=0.7)  # Higher temperature for variation
-        
-        response = question_model.invoke(prompt)
+        # Keep the context for later evaluation server-side instead of in the page
+        quiz_id = quiz_sessions.create(entry['question'], model, entry['doc_ids'], entry['context'])
         
         return jsonify({
-            'question': response.strip(),
-            'model': rag_chain.model_name,
-            'context': context  # Store context for later evaluation
+            'question': entry['question'],
+            'model': model,
+            'quiz_id': quiz_id
         })
+    except (QueueFull, QueueTimeout, NotReady) as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         import traceback
         print(f"Error generating question: {traceback.format_exc()}")
         return jsonify({'error': str(e)}), 500
 
+# Longer answers are refused before grading: every character of the answer is
+# prompt budget taken from the course material it is graded against
+MAX_ANSWER_CHARS = int(os.environ.get("MAX_ANSWER_CHARS", "2000"))
+
+def grade_answer(model, question, context, answer, priority=PRIORITY_GRADING, route='grading'):
+    """Have the model give feedback on a student's answer
+
+    Returns (explanation, prompt). Raises QueueFull/QueueTimeout if no slot is
+    free, or PromptTooLong if the question and answer alone overflow the budget.
+    """
+    # Evaluate the answer; a long answer leaves less room for the material
+    evaluation_prompt = prompt_builder.build(
+        GRADING_TEMPLATE, [context] if context else [], model, question=question, answer=answer
+    )
+    log_prompt(route, model, evaluation_prompt)
+    
+    with scheduler.slot(model, priority):
+        response = get_models().get(model).invoke(evaluation_prompt.text, config=run_config(route))
+    
+    # Parse the response - remove "EXPLANATION:" prefix if present
+    explanation = response
+    if "EXPLANATION:" in response:
+        explanation = response.split("EXPLANATION:", 1)[1].strip()
+    return explanation, evaluation_prompt
+
 @app.route('/submit_answer', methods=['POST'])
 def submit_answer():
     data = request.json
     question = data.get('question', '').strip()
     answer = data.get('answer', '').strip()
     context = data.get('context', '')
-    model = data.get('model', rag_chain.model_name)
+    model = data.get('model') or DEFAULT_MODEL
+    
+    # Questions from /generate_question are referenced by token; the posted
+    # question/context pair is still accepted from older pages
+    quiz_id = data.get('quiz_id')
+    if quiz_id:
+        session = quiz_sessions.get(quiz_id)
+        if session is None:
+            return jsonify({'error': 'This question has expired, please generate a new one'}), 404
+        question = session['question']
+        context = session['context']
     
     if not question or not answer:
         return jsonify({'error': 'Question and answer are required'}), 400
     
-    # Switch model if different from current
-    if model != rag_chain.model_name:
-        rag_chain.switch_model(model)
+    if len(answer) > MAX_ANSWER_CHARS:
+        return jsonify({'error': f'Answers can be at most {MAX_ANSWER_CHARS} characters'}), 400
+    
+    if model not in AVAILABLE_MODELS:
+        return jsonify({'error': f'Model {model} not available'}), 400
     
     try:
-        # Evaluate the answer
-        evaluation_prompt = f"""You are a teacher evaluating a student's answer. Based on the course material provided, provide feedback on the student's answer.
-
-Course Material:
-{context}
-
-Question: {question}
-
-Student's Answer: {answer}
-
-Provide a brief explanation (2-3 sentences) evaluating the answer. If the answer is incorrect or partially correct, explain what the correct answer should include.
-"""
-        
-        response = rag_chain.ollama.invoke(evaluation_prompt)
-        
-        # Parse the response - remove "EXPLANATION:" prefix if present
-        explanation = response
-        if "EXPLANATION:" in response:
-            explanation = response.split("EXPLANATION:", 1)[1].strip()
+        explanation, evaluation_prompt = grade_answer(model, question, context, answer)
         
         return jsonify({
             'explanation': explanation,
-            'model': rag_chain.model_name
+            'model': model,
+            'prompt_tokens': evaluation_prompt.tokens
         })
+    except PromptTooLong as e:
+        return jsonify({'error': str(e)}), 400
+    except (QueueFull, QueueTimeout, NotReady) as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         import traceback
         print(f"Error evaluating answer: {traceback.format_exc()}")
         return jsonify({'error': str(e)}), 500
 
+# A batch holds at most this many answers, and grades at most BATCH_GRADING_WORKERS
+# of them at once so a whole class's answers never fill the scheduler's queue
+MAX_BATCH_ITEMS = int(os.environ.get("BATCH_GRADING_MAX_ITEMS", "200"))
+BATCH_GRADING_WORKERS = int(os.environ.get("BATCH_GRADING_WORKERS", os.environ.get("OLLAMA_MAX_CONCURRENT", "2")))
+
+def normalize_answer(answer):
+    """Answers differing only in case or spacing are graded once"""
+    return " ".join(answer.split()).casefold()
+
+def resolve_batch_item(item):
+    """Return (question, context, answer) of a batch item, or raise ValueError"""
+    if not isinstance(item, dict):
+        raise ValueError('Each item must be an object')
+    question = (item.get('question') or '').strip()
+    context = item.get('context') or ''
+    answer = (item.get('answer') or '').strip()
+    quiz_id = item.get('quiz_id')
+    if quiz_id:
+        session = quiz_sessions.get(quiz_id)
+        if session is None:
+            raise ValueError('This question has expired')
+        question = session['question']
+        context = session['context']
+    if not question or not answer:
+        raise ValueError('Question and answer are required')
+    if len(answer) > MAX_ANSWER_CHARS:
+        raise ValueError(f'Answers can be at most {MAX_ANSWER_CHARS} characters')
+    return question, context, answer
+
+def grade_batch_results(model, items):
+    """Grade a batch of answers, yielding one result dict per item as it is ready
+
+    Items with the same question, material and (normalised) answer share one
+    generation; its result is yielded for each of them, with 'duplicate_of'
+    set to the index of the first. Invalid items and failed generations give
+    a result with an 'error' instead of stopping the batch. Closing the
+    generator cancels the generations that have not started.
+    """
+    groups = {}  # (question, context, normalised answer) -> item indexes
+    for index, item in enumerate(items):
+        item_id = item.get('id', index) if isinstance(item, dict) else index
+        try:
+            question, context, answer = resolve_batch_item(item)
+        except ValueError as e:
+            yield {'index': index, 'id': item_id, 'error': str(e)}
+            continue
+        key = (question, context, normalize_answer(answer))
+        groups.setdefault(key, []).append((index, item_id, answer))
+    
+    executor = ThreadPoolExecutor(max_workers=max(1, BATCH_GRADING_WORKERS))
+    try:
+        futures = {
+            executor.submit(grade_answer, model, question, context, members[0][2], route='grade_batch'): members
+            for (question, context, _), members in groups.items()
+        }
+        for future in as_completed(futures):
+            members = futures[future]
+            first = members[0][0]
+            try:
+                explanation, evaluation_prompt = future.result()
+                result = {'explanation': explanation, 'prompt_tokens': evaluation_prompt.tokens}
+            except Exception as e:
+                if not isinstance(e, (QueueFull, QueueTimeout, NotReady, PromptTooLong)):
+                    print(f"Error evaluating answer {first} of batch: {e}")
+                result = {'error': str(e)}
+            for index, item_id, _ in members:
+                yield dict(result, index=index, id=item_id, **({'duplicate_of': first} if index != first else {}))
+    finally:
+        # Also runs when the client disconnects mid-stream (GeneratorExit)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+@app.route('/grade_batch', methods=['POST'])
+def grade_batch():
+    """Grade many answers at once, e.g. a whole class at the end of a lesson
+
+    Takes {"model": ..., "items": [{"id", "quiz_id" or "question"/"context", "answer"}]}
+    and streams one event per item as soon as it is graded, in completion
+    order; with "stream": false returns all results in item order instead.
+    """
+    data = request.json
+    items = data.get('items')
+    model = data.get('model') or DEFAULT_MODEL
+    stream = data.get('stream', True)
+    
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Items must be a non-empty list'}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({'error': f'At most {MAX_BATCH_ITEMS} items can be graded at once'}), 400
+    if model not in AVAILABLE_MODELS:
+        return jsonify({'error': f'Model {model} not available'}), 400
+    
+    if not stream:
+        results = sorted(grade_batch_results(model, items), key=lambda result: result['index'])
+        return jsonify({'results': results, 'model': model})
+    
+    def generate():
+        failed = 0
+        try:
+            for result in grade_batch_results(model, items):
+                failed += 'error' in result
+                yield sse(dict(result, done=False))
+            yield sse({'done': True, 'model': model, 'items': len(items), 'failed': failed})
+        except Exception as e:
+            import traceback
+            print(f"Error in grade_batch(): {str(e)}\n{traceback.format_exc()}")
+            yield sse({'error': str(e), 'done': True})
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 if __name__ == '__main__':
     # Get port from environment variable (Railway provides this)
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,154 @@
+"""ASGI entry point: run with `uvicorn asgi:app --host 0.0.0.0 --port 5000`
+
+/chat is served natively async: tokens are streamed from Ollama over
+non-blocking HTTP, so one process can hold hundreds of open SSE connections,
+and the upstream generation is cancelled as soon as the client disconnects.
+Every other route is the existing Flask app, mounted as WSGI.
+"""
+import asyncio
+from contextlib import suppress
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+import app as flask_app
+from app import AVAILABLE_MODELS, DEFAULT_MODEL, chunk_to_text, get_models, prepare_chat, scheduler, sse
+from metrics import run_config
+from prompt_builder import PromptTooLong
+from scheduler import PRIORITY_CHAT, QueueFull, QueueTimeout
+from startup import NotReady
+
+# How often to check for a disconnect while waiting for the model (e.g. during prefill)
+DISCONNECT_POLL_SECONDS = 0.25
+# How often a queued request re-checks its place without holding a thread
+QUEUE_POLL_SECONDS = 0.25
+
+async def _wait_for_disconnect(request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+async def queue_positions(ticket):
+    """Async version of Ticket.positions(): yields position changes until admitted"""
+    last = None
+    while position := ticket.check():
+        if position != last:
+            yield position
+            last = position
+        await asyncio.sleep(QUEUE_POLL_SECONDS)
+
+async def stream_until_disconnect(request, chunks):
+    """Yield from an async iterator, closing it as soon as the client goes away
+
+    Closing the Ollama stream closes its HTTP connection, which makes Ollama
+    stop generating instead of running the answer to completion for nobody.
+    """
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    next_chunk = None
+    try:
+        while True:
+            next_chunk = asyncio.ensure_future(chunks.__anext__())
+            await asyncio.wait({next_chunk, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_chunk.done():
+                print("Client disconnected, cancelling generation")
+                return
+            try:
+                yield next_chunk.result()
+            except StopAsyncIteration:
+                return
+    finally:
+        # Also reached when the server cancels this response on disconnect
+        watcher.cancel()
+        if next_chunk is not None and not next_chunk.done():
+            next_chunk.cancel()
+            with suppress(asyncio.CancelledError, StopAsyncIteration):
+                await next_chunk
+        await chunks.aclose()
+
+async def chat(request):
+    data = await request.json()
+    query = data.get('query', '').strip()
+    model = data.get('model') or DEFAULT_MODEL
+    stream = data.get('stream', True)  # Default to streaming
+
+    if not query:
+        return JSONResponse({'error': 'Query cannot be empty'}, status_code=400)
+
+    if model not in AVAILABLE_MODELS:
+        return JSONResponse({'error': f'Model {model} not available'}, status_code=400)
+
+    if not stream:
+        try:
+            cached, prompt, store = await run_in_threadpool(prepare_chat, query, model)
+            if cached is not None:
+                return JSONResponse({'response': cached, 'model': model, 'cached': True})
+            llm = (await run_in_threadpool(get_models)).get(model)
+            ticket = scheduler.enqueue(model, PRIORITY_CHAT)
+            try:
+                async for _ in queue_positions(ticket):
+                    pass
+                response = await llm.ainvoke(prompt.text, config=run_config('chat'))
+            finally:
+                ticket.release()
+            store(response)
+            return JSONResponse({'response': response, 'model': model, 'prompt_tokens': prompt.tokens})
+        except PromptTooLong as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+        except (QueueFull, QueueTimeout, NotReady) as e:
+            return JSONResponse({'error': str(e)}, status_code=503)
+        except Exception as e:
+            return JSONResponse({'error': str(e)}, status_code=500)
+
+    async def generate():
+        try:
+            # Retrieval and embedding are CPU-bound, keep them off the event loop
+            cached, prompt, store = await run_in_threadpool(prepare_chat, query, model)
+            if cached is not None:
+                yield sse({'chunk': cached, 'done': False})
+                yield sse({'chunk': '', 'done': True, 'model': model, 'cached': True})
+                return
+
+            # Waits for startup if a request arrives before the model clients are set up
+            llm = (await run_in_threadpool(get_models)).get(model)
+            answer_parts = []
+            ticket = scheduler.enqueue(model, PRIORITY_CHAT)
+            try:
+                async for position in queue_positions(ticket):
+                    if await request.is_disconnected():
+                        return
+                    yield sse({'queued': True, 'position': position, 'done': False})
+
+                chunks = llm.astream(prompt.text, config=run_config('chat'))
+                async for chunk in stream_until_disconnect(request, chunks):
+                    chunk_text = chunk_to_text(chunk)
+                    if chunk_text:
+                        answer_parts.append(chunk_text)
+                        yield sse({'chunk': chunk_text, 'done': False})
+
+                if await request.is_disconnected():
+                    return
+                if not answer_parts:
+                    print("No chunks received from stream, using invoke instead")
+                    response = await llm.ainvoke(prompt.text, config=run_config('chat'))
+                    answer_parts.append(str(response))
+                    yield sse({'chunk': str(response), 'done': False})
+            finally:
+                ticket.release()
+
+            store(''.join(answer_parts))
+            yield sse({'chunk': '', 'done': True, 'model': model, 'prompt_tokens': prompt.tokens})
+        except Exception as e:
+            import traceback
+            print(f"Error in generate(): {str(e)}\n{traceback.format_exc()}")
+            yield sse({'error': str(e), 'done': True})
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+app = Starlette(routes=[
+    Route('/chat', chat, methods=['POST']),
+    Mount('/', app=WSGIMiddleware(flask_app.app)),
+])
@@ -0,0 +1,220 @@
+"""Benchmark page extraction over a saved corpus of BBC Bitesize pages
+
+    python benchmarks/extraction.py corpus/                 # time the pages saved in corpus/
+    python benchmarks/extraction.py corpus/ --download 50   # first save up to 50 pages from the last crawl
+
+The corpus is a folder of .html files plus a urls.json mapping each file to
+the URL it came from. --download fills it with pages recorded in the
+crawler's checkpoint (docs/.crawl_state.json), at the crawler's rate limit.
+
+Prints the per-page time of the crawler's single lxml parse (parse_page)
+next to the BeautifulSoup extractor it replaced (baseline_extract below, a
+copy of the crawler's old extract_content and find_links, each parsing the
+page with html.parser), then checks that both give the same title, content
+and links for every page, printing how they differ and exiting 1 where they do not.
+
+Intended differences are allowed: parse_page writes each heading before its
+section's text, where the old extractor wrote all headings first, so content
+is compared as the same headings and paragraphs in any order.
+"""
+import argparse
+import difflib
+import importlib.util
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from urllib.parse import urljoin, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webcrawler import CRAWL_STATE_FILE, BBCBitesizeCrawler
+
+def download(crawler, corpus, count, state_path):
+    """Save up to count pages listed in a crawl checkpoint into the corpus folder"""
+    with open(state_path, "r", encoding="utf-8") as file:
+        urls = sorted(json.load(file)["pages"])[:count]
+    index = {}
+    for i, url in enumerate(urls):
+        crawler.rate_limiter(url).acquire()
+        response = crawler.session.get(url, timeout=10)
+        if response.status_code != 200:
+            print(f"Skipping {url}: HTTP {response.status_code}")
+            continue
+        filename = f"page_{i:04d}.html"
+        with open(os.path.join(corpus, filename), "w", encoding="utf-8") as file:
+            file.write(response.text)
+        index[filename] = url
+    with open(os.path.join(corpus, "urls.json"), "w", encoding="utf-8") as file:
+        json.dump(index, file, indent=1)
+    print(f"Saved {len(index)} pages to {corpus}")
+
+def load_corpus(corpus):
+    with open(os.path.join(corpus, "urls.json"), "r", encoding="utf-8") as file:
+        index = json.load(file)
+    pages = []
+    for filename, url in sorted(index.items()):
+        with open(os.path.join(corpus, filename), "r", encoding="utf-8") as file:
+            pages.append((url, file.read()))
+    return pages
+
+def _clean_text(text):
+    if not text:
+        return ""
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+def baseline_extract(crawler, html, url):
+    """The crawler's extraction before parse_page: (title, content, links) from two html.parser parses"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    for script in soup(["script", "style", "nav", "header", "footer", "aside"]):
+        script.decompose()
+    for elem in soup.find_all(['nav', 'header', 'footer', 'aside', 'button', 'form']):
+        elem.decompose()
+
+    content = []
+    title = ""
+    title_elem = (
+        soup.find('h1', class_=re.compile(r'title|heading', re.I)) or
+        soup.find('h1') or
+        soup.find('title')
+    )
+    if title_elem:
+        title = _clean_text(title_elem.get_text())
+        title = re.sub(r'^\s*BBC\s+Bitesize\s*[-–—]\s*', '', title, flags=re.I)
+
+    main_content = (
+        soup.find('main') or
+        soup.find('article') or
+        soup.find('div', class_=re.compile(r'content|main|article|text|body|guide|topic|revision', re.I)) or
+        soup.find('div', id=re.compile(r'content|main|article|body', re.I)) or
+        soup.find('div', {'data-testid': re.compile(r'content|article|main', re.I)})
+    )
+    if main_content:
+        for heading in main_content.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
+            text = _clean_text(heading.get_text())
+            if text and len(text) > 3:
+                content.append(f"\n{text}\n{'=' * len(text)}\n")
+        for elem in main_content.find_all(['p', 'li', 'dd', 'dt', 'blockquote']):
+            text = _clean_text(elem.get_text())
+            if text and len(text) > 10:
+                if not any(text in existing for existing in content[-5:]):
+                    content.append(text)
+    else:
+        for elem in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'li']):
+            text = _clean_text(elem.get_text())
+            if text and len(text) > 10:
+                content.append(text)
+
+    cleaned_content = []
+    seen = set()
+    for item in content:
+        item_lower = item.lower().strip()
+        if item_lower and item_lower not in seen and len(item_lower) > 10:
+            seen.add(item_lower)
+            cleaned_content.append(item)
+
+    # find_links parsed the page a second time
+    soup = BeautifulSoup(html, 'html.parser')
+    links = set()
+    for link in soup.find_all('a', href=True):
+        href = link.get('href')
+        if not href or href.startswith(('mailto:', 'tel:', 'javascript:', '#')):
+            continue
+        parsed = urlparse(urljoin(url, href))
+        normalized_url = f"{parsed.scheme}://{parsed.netloc}{parsed.path.rstrip('/')}"
+        if parsed.query:
+            normalized_url += f"?{parsed.query}"
+        if crawler.is_relevant_url(normalized_url):
+            links.add(normalized_url)
+
+    return title, '\n\n'.join(cleaned_content), links
+
+def content_items(content):
+    """The headings and paragraphs of extracted content, sorted, as their order is allowed to differ"""
+    return sorted(item.strip() for item in content.split("\n\n") if item.strip())
+
+def compare_outputs(pages, crawler, show):
+    """Count pages where parse_page and the baseline disagree; print a diff of the first show of them"""
+    differing = 0
+    for url, html in pages:
+        title, content, links = crawler.parse_page(html, url)
+        new = (title, content_items(content), links)
+        old_title, old_content, old_links = baseline_extract(crawler, html, url)
+        old = (old_title, content_items(old_content), old_links)
+        if new == old:
+            continue
+        differing += 1
+        if differing > show:
+            continue
+        print(f"\n{url}")
+        if new[0] != old[0]:
+            print(f"  title: {old[0]!r} -> {new[0]!r}")
+        if new[1] != old[1]:
+            diff = difflib.unified_diff(old[1], new[1], "baseline", "parse_page", lineterm="", n=1)
+            for line in list(diff)[2:42]:
+                print(f"  {line}")
+        if new[2] != old[2]:
+            for link in sorted(old[2] - new[2]):
+                print(f"  - link {link}")
+            for link in sorted(new[2] - old[2]):
+                print(f"  + link {link}")
+    print(f"\nOutput matches on {len(pages) - differing}/{len(pages)} pages")
+    return differing
+
+def time_per_page(pages, extract, repeat):
+    """Best-of-repeat seconds for each page"""
+    times = []
+    for url, html in pages:
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            extract(html, url)
+            best = min(best, time.perf_counter() - started)
+        times.append(best)
+    return times
+
+def report(name, times):
+    ms = sorted(t * 1000 for t in times)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    print(f"{name:<32} mean {statistics.mean(ms):7.2f} ms  median {statistics.median(ms):7.2f} ms  "
+          f"p95 {p95:7.2f} ms  ({len(ms) / sum(times):.0f} pages/sec)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark crawler page extraction")
+    parser.add_argument("corpus", help="folder of saved .html pages with a urls.json index")
+    parser.add_argument("--download", type=int, metavar="N", help="first save up to N pages from the last crawl")
+    parser.add_argument("--state", default=os.path.join("docs", CRAWL_STATE_FILE), help="crawl checkpoint to take URLs from")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per page, the fastest is kept")
+    parser.add_argument("--show-diffs", type=int, default=5, metavar="N", help="pages whose output differs to print a diff of")
+    args = parser.parse_args()
+
+    # Extraction does not write anything; keep the crawler's output folder out of the way
+    crawler = BBCBitesizeCrawler(output_dir=tempfile.mkdtemp(prefix="bench-crawl-"))
+    if args.download:
+        os.makedirs(args.corpus, exist_ok=True)
+        download(crawler, args.corpus, args.download, args.state)
+
+    pages = load_corpus(args.corpus)
+    if not pages:
+        print(f"No pages in {args.corpus}")
+        return
+    print(f"{len(pages)} pages, {sum(len(html) for _, html in pages) / len(pages) / 1024:.0f} KiB on average\n")
+
+    report("parse_page (lxml, one parse)", time_per_page(pages, crawler.parse_page, args.repeat))
+    if importlib.util.find_spec("bs4") is None:
+        print("beautifulsoup4 not installed, skipping the html.parser baseline")
+        return
+
+    report("old extractor (2x html.parser)",
+           time_per_page(pages, lambda html, url: baseline_extract(crawler, html, url), args.repeat))
+    if compare_outputs(pages, crawler, args.show_diffs):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""Stand-in Ollama server for load testing the app without real models
+
+    python benchmarks/fake_ollama.py                                 # on localhost:11434, like Ollama
+    python benchmarks/fake_ollama.py --rate 15 --parallel 2 --load-seconds 4
+    python benchmarks/fake_ollama.py --responses answers.txt         # replay your own answers
+
+Serves /api/generate and /api/chat (streamed or not), /api/tags and /api/ps
+with Ollama's response format, so the app, model_registry.py and start.sh's
+warm-up run against it unchanged. Timing is simulated:
+
+- a model that is not loaded takes --load-seconds to load, and stays loaded
+  for the request's keep_alive (default 5m, as in Ollama) after its last use;
+- each model runs at most --parallel generations at once, the rest queue;
+- the prompt is evaluated at --prompt-rate tokens/sec (about 4 characters per
+  token) before the first token, then tokens stream at --rate tokens/sec,
+  each delay varied by up to --jitter.
+
+Answers are taken in turn from --responses, a text file of answers separated
+by blank lines, and cut to --tokens words. A client that disconnects stops
+its generation, as with Ollama.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import cycle
+
+DEFAULT_RESPONSES = [
+    "A surd is a root of a number that cannot be simplified to remove the root, such as the square root "
+    "of 2. Surds are left in this form to keep answers exact. To simplify a surd, look for square number "
+    "factors: the square root of 12 is the square root of 4 times 3, which is 2 root 3.",
+    "Pythagoras' theorem states that in a right-angled triangle the square of the hypotenuse is equal to "
+    "the sum of the squares of the other two sides, a squared plus b squared equals c squared. It is used "
+    "to find a missing side when the other two sides are known.",
+    "To solve a quadratic equation, rearrange it so one side is zero, then factorise, complete the square "
+    "or use the quadratic formula. Each factor set equal to zero gives one solution, so a quadratic has "
+    "at most two real roots.",
+]
+DURATION_PATTERN = re.compile(r"^(-?\d+(?:\.\d+)?)(ms|s|m|h)?$")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}
+
+def parse_keep_alive(value, default=300.0):
+    """Seconds a model stays loaded: Ollama accepts "5m", "1h", seconds, and negative for ever"""
+    if value is None or value == "":
+        return default
+    match = DURATION_PATTERN.match(str(value).strip())
+    if not match:
+        return default
+    seconds = float(match.group(1)) * DURATION_UNITS[match.group(2)]
+    return float("inf") if seconds < 0 else seconds
+
+class FakeModels:
+    """Loaded state and generation slots of the simulated models"""
+
+    def __init__(self, load_seconds, parallel):
+        self.load_seconds = load_seconds
+        self.parallel = parallel
+        self.lock = threading.Lock()
+        self.expires = {}  # model -> time it unloads
+        self.loading = {}  # model -> lock held while it loads
+        self.slots = {}  # model -> semaphore of --parallel slots
+
+    def slot(self, model):
+        with self.lock:
+            if model not in self.slots:
+                self.slots[model] = threading.BoundedSemaphore(self.parallel)
+                self.loading[model] = threading.Lock()
+            return self.slots[model]
+
+    def ensure_loaded(self, model):
+        """Load a model if it is not resident; returns the seconds spent loading"""
+        self.slot(model)
+        with self.loading[model]:
+            with self.lock:
+                if self.expires.get(model, 0) > time.monotonic():
+                    return 0.0
+            time.sleep(self.load_seconds)
+            with self.lock:
+                self.expires[model] = float("inf")  # until touch() sets the keep_alive
+            return self.load_seconds
+
+    def touch(self, model, keep_alive):
+        with self.lock:
+            self.expires[model] = time.monotonic() + keep_alive
+
+    def loaded(self):
+        now = time.monotonic()
+        with self.lock:
+            return sorted(model for model, expires in self.expires.items() if expires > now)
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self.send_json({"models": [{"name": model, "model": model} for model in self.server.models.loaded()]})
+        elif self.path == "/api/ps":
+            self.send_json({"models": [{"name": model, "model": model} for model in self.server.models.loaded()]})
+        elif self.path in ("/", "/api/version"):
+            self.send_json({"version": "fake"})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if self.path not in ("/api/generate", "/api/chat"):
+            self.send_json({"error": "not found"}, 404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        model = body.get("model", "")
+        if not model:
+            self.send_json({"error": "model is required"}, 400)
+            return
+        if self.path == "/api/chat":
+            prompt = " ".join(message.get("content", "") for message in body.get("messages", []))
+        else:
+            prompt = body.get("prompt") or ""
+        self.generate(model, prompt, body.get("stream", True), parse_keep_alive(body.get("keep_alive")))
+
+    def generate(self, model, prompt, stream, keep_alive):
+        config = self.server.config
+        models = self.server.models
+        started = time.perf_counter()
+        chat = self.path == "/api/chat"
+
+        with models.slot(model):
+            load = models.ensure_loaded(model)
+            try:
+                if not prompt:
+                    # A request without a prompt only loads the model, as used for warm-up
+                    self.send_json(self.final(model, chat, started, load, 0, 0, 0, 0))
+                    return
+
+                prompt_tokens = max(1, len(prompt) // 4)
+                prompt_seconds = prompt_tokens / config.prompt_rate
+                time.sleep(self.jitter(prompt_seconds))
+                words = next(self.server.responses).split()[:config.tokens]
+                tokens = [word + " " for word in words[:-1]] + words[-1:]
+
+                eval_started = time.perf_counter()
+                if stream:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    try:
+                        for token in tokens:
+                            time.sleep(self.jitter(1 / config.rate))
+                            self.chunk(self.part(model, chat, token))
+                        eval_seconds = time.perf_counter() - eval_started
+                        self.chunk(self.final(model, chat, started, load, prompt_tokens, prompt_seconds,
+                                              len(tokens), eval_seconds))
+                        self.wfile.write(b"0\r\n\r\n")
+                    except (BrokenPipeError, ConnectionResetError):
+                        # The client went away; stop generating like Ollama does
+                        self.close_connection = True
+                else:
+                    time.sleep(sum(self.jitter(1 / config.rate) for _ in tokens))
+                    eval_seconds = time.perf_counter() - eval_started
+                    final = self.final(model, chat, started, load, prompt_tokens, prompt_seconds,
+                                       len(tokens), eval_seconds)
+                    final.update(self.part(model, chat, "".join(tokens)))
+                    final["done"] = True
+                    self.send_json(final)
+            finally:
+                models.touch(model, keep_alive)
+
+    def jitter(self, seconds):
+        return seconds * (1 + random.uniform(-1, 1) * self.server.config.jitter)
+
+    def chunk(self, payload):
+        data = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def part(self, model, chat, text):
+        payload = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(), "done": False}
+        if chat:
+            payload["message"] = {"role": "assistant", "content": text}
+        else:
+            payload["response"] = text
+        return payload
+
+    def final(self, model, chat, started, load, prompt_tokens, prompt_seconds, eval_count, eval_seconds):
+        payload = self.part(model, chat, "")
+        payload.update({
+            "done": True,
+            "done_reason": "stop" if eval_count else "load",
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+            "load_duration": int(load * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prompt_seconds * 1e9),
+            "eval_count": eval_count,
+            "eval_duration": int(eval_seconds * 1e9),
+        })
+        return payload
+
+def load_responses(path):
+    if not path:
+        return DEFAULT_RESPONSES
+    with open(path, "r", encoding="utf-8") as file:
+        responses = [part.strip() for part in file.read().split("\n\n") if part.strip()]
+    if not responses:
+        raise SystemExit(f"No responses in {path}")
+    return responses
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a stand-in Ollama API with simulated timing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--rate", type=float, default=20, help="output tokens per second")
+    parser.add_argument("--prompt-rate", type=float, default=400, help="prompt tokens evaluated per second")
+    parser.add_argument("--tokens", type=int, default=60, help="maximum tokens per answer")
+    parser.add_argument("--load-seconds", type=float, default=2.0, help="time to load a model that is not resident")
+    parser.add_argument("--parallel", type=int, default=1, help="generations per model at once, like OLLAMA_NUM_PARALLEL")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative random variation of every delay")
+    parser.add_argument("--responses", help="text file of answers separated by blank lines")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    server.config = args
+    server.models = FakeModels(args.load_seconds, args.parallel)
+    server.responses = cycle(load_responses(args.responses))
+    print(f"Fake Ollama on http://{args.host}:{args.port}: {args.rate:g} tokens/sec, up to {args.tokens} tokens, "
+          f"{args.parallel} parallel per model, {args.load_seconds:g}s model load")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Drive the running app with simulated students and report throughput and latency
+
+    python benchmarks/fake_ollama.py &                       # or a real Ollama
+    python app.py &                                          # or uvicorn asgi:app --port 5000
+    python benchmarks/load_test.py --students 30 --duration 120
+    python benchmarks/load_test.py --mix chat=1 --students 100 --output chat.json
+
+Each student repeatedly picks a scenario by the weights in --mix, runs it,
+then thinks for an exponentially distributed --think seconds on average:
+
+- chat: streaming /chat, as the page does
+- chat_json: /chat with "stream": false
+- quiz: /generate_question, then /submit_answer with the returned quiz_id
+
+Per endpoint it reports requests, errors (HTTP errors, error events and
+connection failures), throughput, and percentiles of time-to-first-token
+and total latency. For streaming /chat the first token is the first
+answer chunk, after any queue position events; for the other endpoints it
+equals the total.
+"""
+import argparse
+import json
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+import requests
+
+QUERIES = [
+    "What is a surd?",
+    "How do I simplify the square root of 50?",
+    "Explain Pythagoras' theorem",
+    "How do you solve a quadratic equation by factorising?",
+    "What is the difference between mean, median and mode?",
+    "How do I find the gradient of a straight line?",
+    "What is SOHCAHTOA?",
+    "How do you work out compound interest?",
+    "What are simultaneous equations?",
+    "How do I calculate the area of a circle?",
+]
+TOPICS = ["", "surds", "Pythagoras", "quadratic equations", "probability", "trigonometry"]
+ANSWERS = [
+    "I am not sure",
+    "You square both sides and add them together",
+    "It is when you multiply the numbers and then divide by the total",
+    "The answer is 2 root 3 because 12 is 4 times 3",
+]
+
+class Recorder:
+    """Thread-safe samples of every endpoint"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)  # endpoint -> [(ok, ttft, total)]
+        self.errors = defaultdict(lambda: defaultdict(int))  # endpoint -> message -> count
+
+    def record(self, endpoint, ok, ttft, total, error=None):
+        with self.lock:
+            self.samples[endpoint].append((ok, ttft, total))
+            if error:
+                self.errors[endpoint][error[:120]] += 1
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda fraction: ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+    return {
+        "mean": round(statistics.mean(ordered), 3),
+        "p50": round(pick(0.5), 3),
+        "p90": round(pick(0.9), 3),
+        "p99": round(pick(0.99), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+class Student(threading.Thread):
+    """One simulated student running scenarios until the deadline"""
+
+    def __init__(self, number, args, recorder, deadline):
+        super().__init__(daemon=True)
+        self.args = args
+        self.recorder = recorder
+        self.deadline = deadline
+        self.random = random.Random(args.seed + number)
+        self.session = requests.Session()
+        self.scenarios, self.weights = zip(*args.mix.items())
+
+    def run(self):
+        # Students arrive over the first few seconds rather than all at once
+        time.sleep(self.random.uniform(0, self.args.ramp))
+        while time.monotonic() < self.deadline:
+            getattr(self, self.random.choices(self.scenarios, self.weights)[0])()
+            time.sleep(self.random.expovariate(1 / self.args.think) if self.args.think else 0)
+
+    def post(self, endpoint, payload):
+        """POST JSON; returns the response body as a dict, or None after recording a failure"""
+        started = time.perf_counter()
+        try:
+            response = self.session.post(self.args.url + endpoint, json=payload, timeout=self.args.timeout)
+            total = time.perf_counter() - started
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            self.recorder.record(endpoint, False, None, time.perf_counter() - started, type(e).__name__)
+            return None
+        ok = response.status_code == 200 and "error" not in data
+        self.recorder.record(endpoint, ok, total if ok else None, total,
+                             None if ok else f"HTTP {response.status_code}: {data.get('error')}")
+        return data if ok else None
+
+    def chat(self):
+        payload = {"query": self.random.choice(QUERIES), "model": self.args.model, "stream": True}
+        started = time.perf_counter()
+        first_token = None
+        error = None
+        try:
+            with self.session.post(self.args.url + "/chat", json=payload, stream=True,
+                                   timeout=self.args.timeout) as response:
+                if response.status_code != 200:
+                    error = f"HTTP {response.status_code}"
+                else:
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line.startswith("data: "):
+                            continue
+                        event = json.loads(line[6:])
+                        if event.get("error"):
+                            error = event["error"]
+                            break
+                        if event.get("chunk") and first_token is None:
+                            first_token = time.perf_counter() - started
+                        if event.get("done"):
+                            break
+                    else:
+                        error = "stream ended without a done event"
+        except (requests.RequestException, ValueError) as e:
+            error = type(e).__name__
+        self.recorder.record("/chat (stream)", error is None, first_token, time.perf_counter() - started, error)
+
+    def chat_json(self):
+        self.post("/chat", {"query": self.random.choice(QUERIES), "model": self.args.model, "stream": False})
+
+    def quiz(self):
+        question = self.post("/generate_question", {"model": self.args.model, "topic": self.random.choice(TOPICS)})
+        if question is None:
+            return
+        # Reading the question and typing an answer
+        time.sleep(self.random.expovariate(1 / self.args.think) if self.args.think else 0)
+        self.post("/submit_answer", {"model": self.args.model, "quiz_id": question["quiz_id"],
+                                     "answer": self.random.choice(ANSWERS)})
+
+def parse_mix(spec):
+    """Parse "chat=4,chat_json=1,quiz=2" into {"chat": 4.0, ...}"""
+    mix = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, weight = item.partition("=")
+        if name not in ("chat", "chat_json", "quiz"):
+            raise SystemExit(f"Unknown scenario {name!r}, expected chat, chat_json or quiz")
+        mix[name] = float(weight or 1)
+    return mix
+
+def summarise(recorder, elapsed):
+    results = {}
+    for endpoint, samples in sorted(recorder.samples.items()):
+        ok = [sample for sample in samples if sample[0]]
+        results[endpoint] = {
+            "requests": len(samples),
+            "errors": len(samples) - len(ok),
+            "error_rate": round((len(samples) - len(ok)) / len(samples), 4),
+            "throughput": round(len(ok) / elapsed, 3),
+            "ttft_seconds": percentiles([ttft for _, ttft, _ in ok if ttft is not None]),
+            "total_seconds": percentiles([total for _, _, total in ok]),
+            "error_messages": dict(recorder.errors.get(endpoint, {})),
+        }
+    return results
+
+def print_results(results, elapsed, students):
+    print(f"\n{students} students for {elapsed:.0f}s")
+    print(f"{'endpoint':<20} {'requests':>8} {'errors':>7} {'req/s':>7}   "
+          f"{'ttft p50':>8} {'p90':>7} {'p99':>7}   {'total p50':>9} {'p90':>7} {'p99':>7}")
+    for endpoint, result in results.items():
+        ttft, total = result["ttft_seconds"], result["total_seconds"]
+        print(f"{endpoint:<20} {result['requests']:>8} {result['error_rate']:>7.1%} {result['throughput']:>7.2f}   "
+              f"{ttft.get('p50', 0):>8.2f} {ttft.get('p90', 0):>7.2f} {ttft.get('p99', 0):>7.2f}   "
+              f"{total.get('p50', 0):>9.2f} {total.get('p90', 0):>7.2f} {total.get('p99', 0):>7.2f}")
+        for message, count in result["error_messages"].items():
+            print(f"    {count} x {message}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the app with simulated students")
+    parser.add_argument("--url", default="http://localhost:5000", help="base URL of the app")
+    parser.add_argument("--students", type=int, default=20, help="concurrent simulated students")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which students arrive")
+    parser.add_argument("--think", type=float, default=2, help="mean seconds between a student's requests")
+    parser.add_argument("--mix", default="chat=4,chat_json=1,quiz=2", help="scenario weights")
+    parser.add_argument("--model", default="phi")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds before a request counts as failed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    args.url = args.url.rstrip("/")
+    args.mix = parse_mix(args.mix)
+
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + args.duration
+    students = [Student(number, args, recorder, deadline) for number in range(args.students)]
+    for student in students:
+        student.start()
+    try:
+        for student in students:
+            # Requests still running at the deadline are allowed to finish
+            student.join()
+    except KeyboardInterrupt:
+        print("Interrupted, reporting what has finished")
+    elapsed = time.monotonic() - started
+
+    results = summarise(recorder, elapsed)
+    print_results(results, elapsed, args.students)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"students": args.students, "seconds": round(elapsed, 1), "mix": args.mix,
+                       "endpoints": results}, file, indent=1)
+        print(f"\nWrote {args.output}")
+
+if __name__ == "__main__":
+    main()
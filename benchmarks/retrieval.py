@@ -0,0 +1,253 @@
+"""Benchmark ingestion and retrieval on a synthetic or fixture corpus
+
+    python benchmarks/retrieval.py                                  # synthetic corpora of 100, 500 and 2000 documents
+    python benchmarks/retrieval.py --sizes 200 --output before.json
+    python benchmarks/retrieval.py --corpus fixtures/               # .txt/.pdf files plus a questions.json
+    python benchmarks/retrieval.py --compare before.json after.json
+
+Every corpus is written to a fresh temporary directory and indexed there with
+chroma_db.sync_folder, in a process of its own so peak RSS is measured per
+corpus and nothing touches the real chroma_db/ or docs/. Each question is
+then asked through RAGChain.retrieve_with_ids at every --top-k, in vector and
+hybrid mode, with the query embedding cache cleared before each pass.
+
+A synthetic document contains one made-up rule ("the zorvex rule states that
+...") among filler paragraphs of maths vocabulary, and its question asks
+about that rule, so the document is the labelled answer. A fixture corpus
+labels its own questions: questions.json is a list of {"question", "source"}
+with source the file that answers it. Recall@k is the fraction of questions
+with a passage from the labelled file among the top k.
+
+Results are printed and, with --output, written as JSON for --compare.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+VOCABULARY = (
+    "angle area axis bearing binomial chord circle coefficient cone congruent cosine cube cylinder "
+    "denominator diameter equation exponent expression factor fraction frequency function gradient "
+    "graph hypotenuse identity index inequality integer intercept interior median mean mode numerator "
+    "parallel percentage perimeter perpendicular polygon prime prism probability proportion pyramid "
+    "quadratic radius range ratio reciprocal rectangle root sector sequence simultaneous sine sphere "
+    "square standard substitution surface tangent term transformation triangle vector vertex volume"
+).split()
+SYLLABLES = "ka lo mi nu pe ra si to vu xe zor vex tal quin dar bel fen gri hol jun".split()
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def synthetic_corpus(folder, documents, questions, seed=0):
+    """Write documents .txt files into folder; returns [{"question", "source"}] for questions of them"""
+    rng = random.Random(seed)
+    terms = set()
+    labelled = []
+    for i in range(documents):
+        term = ""
+        while not term or term in terms:
+            term = "".join(rng.choice(SYLLABLES) for _ in range(3))
+        terms.add(term)
+        a, b, c, d = rng.sample(VOCABULARY, 4)
+        title = f"The {term} rule for {b}s"
+        fact = f"The {term} rule states that the {a} of a {b} equals the {c} of its {d}."
+        paragraphs = [" ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(40, 80))) + "."
+                      for _ in range(rng.randint(4, 8))]
+        paragraphs.insert(rng.randrange(len(paragraphs) + 1), fact)
+        filename = f"doc_{i:05d}.txt"
+        with open(os.path.join(folder, filename), "w", encoding="utf-8") as file:
+            file.write(f"{title}\n{'=' * len(title)}\n\n" + "\n\n".join(paragraphs) + "\n")
+        labelled.append({"question": f"What does the {term} rule say about the {a} of a {b}?", "source": filename})
+    return random.Random(seed + 1).sample(labelled, min(questions, len(labelled)))
+
+def fixture_corpus(folder, corpus):
+    """Copy a fixture corpus into folder; returns its labelled questions"""
+    for filename in os.listdir(corpus):
+        if filename.endswith((".txt", ".pdf")):
+            shutil.copy2(os.path.join(corpus, filename), folder)
+    with open(os.path.join(corpus, "questions.json"), "r", encoding="utf-8") as file:
+        return json.load(file)
+
+def run_corpus(name, options):
+    """Index one corpus in a temporary directory and time queries against it; runs in a child process"""
+    workdir = tempfile.mkdtemp(prefix="bench-retrieval-")
+    docs = os.path.join(workdir, "docs")
+    os.makedirs(docs)
+    if options["corpus"]:
+        questions = fixture_corpus(docs, options["corpus"])
+    else:
+        questions = synthetic_corpus(docs, options["size"], options["questions"], options["seed"])
+    documents = len(os.listdir(docs))
+
+    # chroma_db and RAGChain open ./chroma_db, so import them only once inside the temporary directory
+    os.chdir(workdir)
+    try:
+        import chroma_db
+        from rag_phi3 import RAGChain
+
+        started = time.perf_counter()
+        with chroma_db.configure_engine(options["backend"], options["batch_size"]):
+            chroma_db.sync_folder(docs)
+        ingest_seconds = time.perf_counter() - started
+        chunks = chroma_db.collection.count()
+        ingest = {
+            "seconds": round(ingest_seconds, 3),
+            "docs_per_second": round(documents / ingest_seconds, 2),
+            "chunks_per_second": round(chunks / ingest_seconds, 2),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+        chain = RAGChain(embedding_backend=options["backend"])
+        records = chain.collection.get(include=["metadatas"])
+        sources = {doc_id: metadata["source"] for doc_id, metadata in zip(records["ids"], records["metadatas"])}
+        queries = []
+        for mode in options["modes"]:
+            for top_k in options["top_k"]:
+                chain._embed_normalized.cache_clear()
+                latencies = []
+                hits = 0
+                for item in questions:
+                    started = time.perf_counter()
+                    ids, _ = chain.retrieve_with_ids(item["question"], top_k=top_k, mode=mode)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    hits += any(sources.get(doc_id) == item["source"] for doc_id in ids)
+                queries.append({
+                    "mode": mode,
+                    "top_k": top_k,
+                    "mean_ms": round(statistics.mean(latencies), 2),
+                    "p50_ms": round(percentile(latencies, 0.5), 2),
+                    "p95_ms": round(percentile(latencies, 0.95), 2),
+                    "p99_ms": round(percentile(latencies, 0.99), 2),
+                    "recall": round(hits / len(questions), 3),
+                })
+        return {
+            "name": name,
+            "documents": documents,
+            "chunks": chunks,
+            "questions": len(questions),
+            "settings": dict(chroma_db.index_settings(), backend=options["backend"]),
+            "ingest": ingest,
+            "queries": queries,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    finally:
+        os.chdir(ROOT)
+        if options["keep"]:
+            print(f"Kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_corpus(result):
+    ingest = result["ingest"]
+    print(f"\n{result['name']}: {result['documents']} documents, {result['chunks']} chunks, "
+          f"{result['questions']} questions")
+    print(f"  ingest  {ingest['seconds']:.1f}s  {ingest['docs_per_second']:.1f} docs/sec  "
+          f"{ingest['chunks_per_second']:.1f} chunks/sec  peak RSS {ingest['peak_rss_mb']:.0f} MB")
+    for query in result["queries"]:
+        print(f"  {query['mode']:<6} top_k={query['top_k']:<3} p50 {query['p50_ms']:7.2f} ms  "
+              f"p95 {query['p95_ms']:7.2f} ms  p99 {query['p99_ms']:7.2f} ms  recall {query['recall']:.3f}")
+
+def flatten(results):
+    """{(corpus, metric): value} of a results file, for comparisons"""
+    metrics = {}
+    for corpus in results["corpora"]:
+        for key in ("docs_per_second", "chunks_per_second", "peak_rss_mb"):
+            metrics[(corpus["name"], f"ingest {key}")] = corpus["ingest"][key]
+        for query in corpus["queries"]:
+            for key in ("p50_ms", "p95_ms", "recall"):
+                metrics[(corpus["name"], f"{query['mode']} top_k={query['top_k']} {key}")] = query[key]
+    return metrics
+
+def compare(old_path, new_path):
+    with open(old_path, "r", encoding="utf-8") as file:
+        old = flatten(json.load(file))
+    with open(new_path, "r", encoding="utf-8") as file:
+        new = flatten(json.load(file))
+    print(f"{'corpus':<18} {'metric':<34} {'old':>10} {'new':>10} {'change':>8}")
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key], new[key]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else ""
+        print(f"{key[0]:<18} {key[1]:<34} {before:>10} {after:>10} {change:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and retrieval offline")
+    parser.add_argument("--sizes", default="100,500,2000", help="synthetic corpus sizes in documents")
+    parser.add_argument("--questions", type=int, default=100, help="labelled questions per synthetic corpus")
+    parser.add_argument("--corpus", help="fixture folder of .txt/.pdf files with a questions.json, instead of synthetic corpora")
+    parser.add_argument("--top-k", default="1,2,5,10", help="top_k values to query with")
+    parser.add_argument("--modes", default="vector,hybrid", help="retrieval modes to query with")
+    parser.add_argument("--backend", default=None, help="embedding backend (default: EMBEDDING_BACKEND or torch)")
+    parser.add_argument("--batch-size", type=int, default=64, help="texts per encode batch")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic corpora")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directories")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two results files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    from embedding import DEFAULT_BACKEND
+    options = {
+        "corpus": os.path.abspath(args.corpus) if args.corpus else None,
+        "questions": args.questions,
+        "top_k": [int(k) for k in args.top_k.split(",")],
+        "modes": args.modes.split(","),
+        "backend": args.backend or DEFAULT_BACKEND,
+        "batch_size": args.batch_size,
+        "seed": args.seed,
+        "keep": args.keep,
+    }
+    if args.corpus:
+        runs = [(os.path.basename(os.path.normpath(args.corpus)), dict(options, size=None))]
+    else:
+        runs = [(f"synthetic-{size}", dict(options, size=int(size))) for size in args.sizes.split(",")]
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "corpora": [],
+    }
+    for name, run_options in runs:
+        # A fresh process per corpus: separate peak RSS, and chroma_db opens the corpus' own store
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            result = pool.submit(run_corpus, name, run_options).result()
+        results["corpora"].append(result)
+        print_corpus(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=1)
+        print(f"\nWrote {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,491 @@
-import chromadb 
-import os 
-from langchain.document_loaders import PyPDFLoader
-from sentence_transformers import SentenceTransformer
+import argparse
+import chromadb
+import hashlib
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from langchain_community.document_loaders import PyPDFLoader
+from chunking import chunk_text, parse_header
+from embedding import BACKENDS, DEFAULT_BACKEND, DEFAULT_MODEL, EmbeddingEngine, record_embedding_model
+from json_file import write_json
+from lexical_index import BM25_PATH, BM25Index
+from near_duplicates import SIGNATURES_FILE, NearDuplicateIndex, combine, signature
 
-client = chromadb.PersistentClient(path="chroma_db")
+EMBEDDING_MODEL = DEFAULT_MODEL
+
+# Chunk sizes are in embedder word pieces; leave room under the model's 256 limit
+CHUNK_TOKENS = 200
+CHUNK_OVERLAP_TOKENS = 40
+BATCH_SIZE = 64
+
+# Files read and parsed ahead of the embedding stage; at most twice this many are in flight
+READ_WORKERS = int(os.environ.get("INGEST_READ_WORKERS", "4"))
+# Pages of a file read ahead of the embedder. A file of at most this many pages (every .txt)
+# is checked for near-duplicates before any of it is embedded
+PAGE_QUEUE_PAGES = int(os.environ.get("INGEST_PAGE_QUEUE", "8"))
+
+# Records what has been indexed from docs/ so unchanged files are not re-embedded
+MANIFEST_PATH = os.path.join("chroma_db", "ingest_manifest.json")
 
-# Use a small embedding model
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
+client = chromadb.PersistentClient(path="chroma_db")
 
+# Vectors are always supplied by our own engine, so no default embedding function
 collection = client.get_or_create_collection(
-    name="documents"
+    name="documents",
+    embedding_function=None
 )
 
-def load_documents_from_folder(folder_path):
-    documents = []
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        
-        if filename.endswith(".txt"):  # Process .txt files
-            with open(file_path, "r", encoding="utf-8") as file:
-                documents.append(file.read())
-        
-        elif filename.endswith(".pdf"):  # Process .pdf files using PyPDFLoader
+# Created on first use so the backend, batch size and workers can be configured first
+engine = None
+
+def configure_engine(backend=DEFAULT_BACKEND, batch_size=BATCH_SIZE, workers=1):
+    """Replace the embedding engine used for ingestion"""
+    global engine
+    if engine is not None:
+        engine.close()
+    engine = EmbeddingEngine(EMBEDDING_MODEL, backend=backend, batch_size=batch_size, workers=workers)
+    return engine
+
+def get_engine():
+    return engine or configure_engine()
+
+def count_tokens(text):
+    """Count tokens the way the embedding model will see them"""
+    return len(get_engine().tokenizer.tokenize(text))
+
+def iter_pages(file_path):
+    """Lazily yield (page number, text) for a .txt or .pdf file; a .txt file is a single page"""
+    if file_path.endswith(".pdf"):
+        # lazy_load parses one page at a time instead of the whole PDF up front
+        for number, page in enumerate(PyPDFLoader(file_path).lazy_load(), start=1):
+            yield number, page.page_content
+        return
+    with open(file_path, "r", encoding="utf-8") as file:
+        yield 1, file.read()
+
+_END_OF_FILE = object()
+
+class PageStream:
+    """The pages of one file, read on a reader thread and handed over through a bounded queue
+
+    pages() yields {"source", "page", "text"} records as they are read, with at
+    most max_pages waiting. Once it is exhausted, signature is the file's
+    near-duplicate signature, folded in page by page, and error the exception
+    that stopped the read, if any.
+    """
+
+    def __init__(self, folder_path, filename, max_pages=PAGE_QUEUE_PAGES):
+        self.path = os.path.join(folder_path, filename)
+        self.filename = filename
+        self.queue = queue.Queue(maxsize=max(1, max_pages))
+        self.cancelled = threading.Event()
+        self.signature = None
+        self.error = None
+
+    def read(self):
+        # Runs on a reader thread
+        try:
+            for number, text in iter_pages(self.path):
+                # Compare the content only, not the crawler's URL/Title header
+                self.signature = combine([self.signature, signature(text[parse_header(text)[2]:])])
+                if not self._put({"source": self.filename, "page": number, "text": text}):
+                    return
+        except Exception as e:
+            self.error = e
+        self._put(_END_OF_FILE)
+
+    def _put(self, item):
+        # Waits while the queue is full; False once the consumer has given up on the file
+        while not self.cancelled.is_set():
             try:
-                loader = PyPDFLoader(file_path)
-                pages = loader.load()
-                pdf_text = " ".join(page.page_content for page in pages)  # Combine all pages
-                documents.append(pdf_text)
-            except Exception as e:
-                print(f"Error reading {filename}: {e}")
-    
-    return documents
-
-def add_documents(documents, base_id_prefix="doc"):
-    ids = [f"{base_id_prefix}-{i}" for i in range(len(documents))]
-    embeddings = embedder.encode(documents, convert_to_numpy=True)
-    collection.upsert(
-        documents=documents,
-        ids=ids,
-        embeddings=embeddings.tolist()
-    )
-
-folder_path = "docs"
-documents = load_documents_from_folder(folder_path)
-if documents:
-    add_documents(documents)
\ No newline at end of file
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def pages(self):
+        while True:
+            item = self.queue.get()
+            if item is _END_OF_FILE:
+                return
+            yield item
+
+    def cancel(self):
+        """Stop reading the file; its reader thread is freed within a moment"""
+        self.cancelled.set()
+
+def iter_documents(folder_path, filenames, workers=READ_WORKERS):
+    """Yield (filename, PageStream) for each file in order, reading ahead on a thread pool
+
+    Up to 2 * workers files are read ahead of the consumer, each holding at
+    most PAGE_QUEUE_PAGES pages until they are taken, so memory stays bounded
+    however large the folder or its PDFs are, while reading and PDF parsing
+    overlap with embedding. A file's pages must be taken before the next file
+    is asked for; any left are dropped.
+    """
+    workers = max(1, workers)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    names = iter(filenames)
+    pending = deque()
+
+    def submit(name):
+        stream = PageStream(folder_path, name)
+        pool.submit(stream.read)
+        pending.append(stream)
+
+    for name in itertools.islice(names, 2 * workers):
+        submit(name)
+    try:
+        while pending:
+            stream = pending.popleft()
+            next_name = next(names, None)
+            if next_name is not None:
+                submit(next_name)
+            try:
+                yield stream.filename, stream
+            finally:
+                stream.cancel()
+    finally:
+        # Also runs when the consumer stops early; files not yet started are never read
+        for stream in pending:
+            stream.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def load_documents_from_folder(folder_path, workers=READ_WORKERS):
+    """Lazily yield a {"source", "page", "text"} record for every page of the .txt and .pdf files in a folder
+
+    Files that cannot be read are reported; the pages read before the error are kept.
+    """
+    filenames = sorted(name for name in os.listdir(folder_path) if name.endswith((".txt", ".pdf")))
+    for filename, stream in iter_documents(folder_path, filenames, workers):
+        yield from stream.pages()
+        if stream.error is not None:
+            print(f"Error reading {filename}: {stream.error}")
+
+def iter_page_chunks(pages):
+    """Lazily chunk page records into token-budgeted passages
+
+    Chunks never span pages; they are numbered consecutively across the pages
+    of a file and record the page they came from.
+    """
+    numbers = {}  # source -> next chunk number
+    for page in pages:
+        source = page["source"]
+        for chunk in chunk_text(
+            page["text"],
+            source,
+            max_tokens=CHUNK_TOKENS,
+            overlap_tokens=CHUNK_OVERLAP_TOKENS,
+            count_tokens=count_tokens
+        ):
+            chunk["metadata"]["chunk"] = numbers.get(source, 0)
+            chunk["metadata"]["page"] = page["page"]
+            numbers[source] = chunk["metadata"]["chunk"] + 1
+            yield chunk
+
+def iter_chunks(documents):
+    """Lazily chunk (filename, text) pairs into token-budgeted passages"""
+    return iter_page_chunks({"source": source, "page": 1, "text": text} for source, text in documents)
+
+def chunk_id(content_hash, chunk):
+    """Stable id for a chunk: the same file content always maps to the same ids"""
+    return f"{content_hash[:16]}-{chunk['metadata']['chunk']}"
+
+def add_documents(chunks, ids=None):
+    """Embed and upsert chunks batch by batch; returns the ids that were stored
+
+    ids is a function of a chunk returning its record id; by default the id is
+    derived from the chunk's source file and position.
+    """
+    if ids is None:
+        ids = lambda chunk: f"{chunk['metadata']['source']}#{chunk['metadata']['chunk']}"
+    stored = []
+    for batch, embeddings in get_engine().iter_batches(chunks, text=lambda chunk: chunk["text"]):
+        batch_ids = [ids(chunk) for chunk in batch]
+        collection.upsert(
+            documents=[chunk["text"] for chunk in batch],
+            ids=batch_ids,
+            embeddings=embeddings.tolist(),
+            metadatas=[chunk["metadata"] for chunk in batch]
+        )
+        stored.extend(batch_ids)
+    return stored
+
+def index_settings():
+    """Settings that change the stored vectors; a change forces a full re-index"""
+    return {
+        "embedding_model": EMBEDDING_MODEL,
+        "chunk_tokens": CHUNK_TOKENS,
+        "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS,
+    }
+
+def load_manifest(manifest_path=MANIFEST_PATH):
+    if not os.path.exists(manifest_path):
+        return {"settings": None, "files": {}}
+    with open(manifest_path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+def save_manifest(manifest, manifest_path=MANIFEST_PATH):
+    """Write the manifest to manifest_path"""
+    write_json(manifest_path, manifest, indent=1, sort_keys=True)
+
+def _delete_unreferenced(ids, files):
+    """Delete ids from the collection unless another indexed file still uses them"""
+    if not ids:
+        return
+    in_use = {i for entry in files.values() for i in entry["ids"]}
+    stale = [i for i in ids if i not in in_use]
+    if stale:
+        collection.delete(ids=stale)
+
+def _open_manifest(manifest_path, rebuild=False):
+    """Load the manifest, clearing the collection if it was built with other settings"""
+    manifest = load_manifest(manifest_path)
+    if rebuild or manifest.get("settings") != index_settings():
+        # Also clears records written before the manifest existed
+        print("No manifest, settings changed or rebuild requested: re-indexing everything")
+        existing = collection.get(include=[])["ids"]
+        if existing:
+            collection.delete(ids=existing)
+        manifest["files"].clear()
+        manifest["settings"] = index_settings()
+    record_embedding_model(collection, EMBEDDING_MODEL)
+    return manifest
+
+def _replace_entries(files, entries):
+    """Point files' manifest entries at their new chunks and drop the chunks no file has any more
+
+    Chunk ids come from file content, so an id one file drops may be taken up
+    by another in the same batch; every entry is replaced before deleting.
+    """
+    old_ids = []
+    for filename, entry in entries.items():
+        if filename in files:
+            old_ids.extend(i for i in files[filename]["ids"] if i not in entry["ids"])
+        files[filename] = entry
+    _delete_unreferenced(old_ids, files)
+
+def sync_folder(folder_path, manifest_path=MANIFEST_PATH, rebuild=False, read_workers=READ_WORKERS):
+    """Bring the collection in line with a folder, embedding only new or changed files
+
+    Files are matched against the manifest by size and mtime first, and by a
+    SHA-256 of their bytes when those differ, so touching a file does not cause
+    it to be re-embedded. Chunks of deleted or changed files are removed. The
+    chunks of all changed files form one stream, so embedding batches stay full,
+    and files are read read_workers at a time ahead of it. A file that cannot
+    be read is reported and left out of the manifest, so the next run retries it.
+
+    A file whose text is a near-duplicate of another file's (per the folder's
+    signature index, shared with the crawler) is recorded but not embedded,
+    and checked again once the file it duplicated changes or is deleted. An
+    exact copy (same content hash) of a stored file is recorded without being
+    read, as its chunks would have the same ids.
+    """
+    manifest = _open_manifest(manifest_path, rebuild)
+    files = manifest["files"]
+    filenames = sorted(name for name in os.listdir(folder_path) if name.endswith((".txt", ".pdf")))
+    duplicates = NearDuplicateIndex(os.path.join(folder_path, SIGNATURES_FILE))
+    # Forget files that are gone, so new files are not skipped as copies of them
+    for filename in duplicates.keys() - set(filenames):
+        duplicates.remove(filename)
+
+    started = time.perf_counter()
+    present = set()
+    changed = {}  # filename -> new manifest entry
+    unchanged = 0
+    for filename in filenames:
+        present.add(filename)
+        stat = os.stat(os.path.join(folder_path, filename))
+        entry = files.get(filename)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            unchanged += 1
+            continue
+
+        with open(os.path.join(folder_path, filename), "rb") as file:
+            content_hash = hashlib.sha256(file.read()).hexdigest()
+        if entry and entry["hash"] == content_hash:
+            entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+            unchanged += 1
+            continue
+        changed[filename] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": content_hash, "ids": []}
+
+    # A copy is checked again once the file it duplicated has changed or gone
+    for filename in filenames:
+        entry = files.get(filename)
+        if filename in changed or not entry or not entry.get("duplicate_of"):
+            continue
+        if entry["duplicate_of"] in changed or entry["duplicate_of"] not in present:
+            changed[filename] = {"size": entry["size"], "mtime": entry["mtime"], "hash": entry["hash"], "ids": []}
+            unchanged -= 1
+    # Changed files are compared by their new text only, whichever order they are read in
+    for filename in changed:
+        duplicates.remove(filename)
+    # Indexed files without a signature (e.g. the signature index was deleted) are read
+    # for one, so changed files are still compared against them
+    signed = duplicates.keys()
+    unsigned = [name for name in filenames
+                if name not in changed and name not in signed and files.get(name, {}).get("ids")]
+    if unsigned:
+        print(f"Computing near-duplicate signatures of {len(unsigned)} indexed files")
+        for filename, stream in iter_documents(folder_path, unsigned, read_workers):
+            for _ in stream.pages():
+                pass
+            if stream.error is None:
+                duplicates.add(filename, stream.signature)
+
+    skipped = 0
+    failures = {}  # filename -> error
+    # Chunk ids come from file content, so an exact copy must never be stored over its
+    # original. Copies are recorded without reading them, short or long
+    stored_hashes = {entry["hash"]: name for name, entry in files.items()
+                     if entry["ids"] and name in present and name not in changed}
+    to_read = []
+    for filename, entry in changed.items():
+        original = stored_hashes.setdefault(entry["hash"], filename)
+        if original == filename:
+            to_read.append(filename)
+            continue
+        print(f"Skipping {filename}: copy of {original}")
+        entry["duplicate_of"] = original
+        skipped += 1
+
+    def settle(filename, stream):
+        """Record a fully read file's error or near-duplicate; True if its chunks are kept"""
+        nonlocal skipped
+        entry = changed[filename]
+        if stream.error is not None:
+            print(f"Error reading {filename}: {stream.error}")
+            entry["failed"] = True
+            failures[filename] = stream.error
+            return False
+        duplicate_of = duplicates.find(stream.signature, exclude=filename)
+        if duplicate_of:
+            print(f"Skipping {filename}: near-duplicate of {duplicate_of}")
+            entry["duplicate_of"] = duplicate_of
+            skipped += 1
+            return False
+        duplicates.add(filename, stream.signature)
+        return True
+
+    def changed_chunks():
+        for filename, stream in iter_documents(folder_path, to_read, read_workers):
+            entry = changed[filename]
+            pages = stream.pages()
+            head = list(itertools.islice(pages, PAGE_QUEUE_PAGES + 1))
+            # A short file is read whole and checked first. A longer one is embedded as it is
+            # read and checked at the end; its chunks are removed again if it is a copy
+            streamed = len(head) > PAGE_QUEUE_PAGES
+            if not streamed and not settle(filename, stream):
+                continue
+            for chunk in iter_page_chunks(itertools.chain(head, pages)):
+                entry["ids"].append(chunk_id(entry["hash"], chunk))
+                yield chunk
+            if streamed:
+                settle(filename, stream)
+
+    removed = [name for name in files if name not in present]
+    try:
+        if to_read:
+            add_documents(
+                changed_chunks(),
+                ids=lambda chunk: chunk_id(changed[chunk["metadata"]["source"]]["hash"], chunk)
+            )
+        # Reached only once every chunk is stored; an interrupted run re-embeds next time.
+        # Long files that failed part way or turned out to be copies were stored as they were read
+        orphans = []
+        for entry in changed.values():
+            if entry.get("failed") or entry.get("duplicate_of"):
+                orphans.extend(entry["ids"])
+                entry["ids"] = []
+        _replace_entries(files, {filename: entry for filename, entry in changed.items()
+                                 if not entry.pop("failed", False)})
+        _delete_unreferenced(orphans, files)
+
+        for filename in removed:
+            _delete_unreferenced(files.pop(filename)["ids"], files)
+            print(f"Removed {filename}")
+    finally:
+        save_manifest(manifest, manifest_path)
+        duplicates.save()
+
+    if len(changed) > len(failures) or removed or not os.path.exists(BM25_PATH):
+        build_lexical_index()
+
+    elapsed = time.perf_counter() - started
+    print(f"Indexed {len(changed) - skipped - len(failures)} new or changed, skipped {skipped} copies and near-duplicates, "
+          f"removed {len(removed)}, unchanged {unchanged} files")
+    if failures:
+        print(f"Could not read {len(failures)} files, they will be retried on the next run:")
+        for filename, error in failures.items():
+            print(f"  {filename}: {error}")
+    if engine is not None and engine.items:
+        print(f"Embedded {engine.items} chunks in {engine.seconds:.1f}s "
+              f"({engine.throughput():.1f} chunks/sec, {len(changed) / elapsed:.1f} docs/sec overall)")
+
+def build_lexical_index(path=BM25_PATH):
+    """Rebuild the BM25 index over every passage in the collection, for hybrid retrieval"""
+    started = time.perf_counter()
+    records = collection.get(include=["documents"])
+    index = BM25Index.build(records["ids"], records["documents"])
+    index.save(path)
+    print(f"Built BM25 index of {len(index)} passages, {len(index.postings)} terms "
+          f"in {time.perf_counter() - started:.1f}s")
+    return index
+
+def index_pages(pages, folder_path="docs", manifest_path=MANIFEST_PATH):
+    """Embed and upsert (filename, text) pairs as they arrive, e.g. from a running crawl
+
+    Each file must already be saved in folder_path with exactly that text; it is
+    recorded in the manifest so a later sync_folder() treats it as unchanged
+    instead of reading and embedding it again. Chunks of consecutive pages
+    share embedding batches. Returns the number of pages indexed.
+    """
+    manifest = _open_manifest(manifest_path)
+    files = manifest["files"]
+    indexed = {}  # filename -> new manifest entry
+
+    def page_chunks():
+        for filename, text in pages:
+            stat = os.stat(os.path.join(folder_path, filename))
+            content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            entry = indexed[filename] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": content_hash, "ids": []}
+            for chunk in iter_chunks([(filename, text)]):
+                entry["ids"].append(chunk_id(content_hash, chunk))
+                yield chunk
+
+    started = time.perf_counter()
+    try:
+        add_documents(
+            page_chunks(),
+            ids=lambda chunk: chunk_id(indexed[chunk["metadata"]["source"]]["hash"], chunk)
+        )
+        # Reached only once every chunk is stored; otherwise sync_folder picks the files up later
+        _replace_entries(files, indexed)
+    finally:
+        save_manifest(manifest, manifest_path)
+    build_lexical_index()
+
+    elapsed = time.perf_counter() - started
+    print(f"Indexed {len(indexed)} pages in {elapsed:.1f}s")
+    if engine is not None and engine.items:
+        print(f"Embedded {engine.items} chunks in {engine.seconds:.1f}s ({engine.throughput():.1f} chunks/sec)")
+    return len(indexed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index the docs folder into ChromaDB")
+    parser.add_argument("folder", nargs="?", default="docs")
+    parser.add_argument("--rebuild", action="store_true", help="re-embed every file")
+    parser.add_argument("--backend", choices=BACKENDS, default=DEFAULT_BACKEND, help="embedding inference backend")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="texts per encode batch")
+    parser.add_argument("--workers", type=int, default=1, help="embedding processes (1 = in-process)")
+    parser.add_argument("--read-workers", type=int, default=READ_WORKERS, help="threads reading and parsing files")
+    args = parser.parse_args()
+
+    with configure_engine(args.backend, args.batch_size, args.workers):
+        sync_folder(args.folder, rebuild=args.rebuild, read_workers=args.read_workers)
@@ -0,0 +1,156 @@
+import re
+
+# all-MiniLM-L6-v2 truncates at 256 word pieces, so keep chunks comfortably below that
+DEFAULT_MAX_TOKENS = 200
+DEFAULT_OVERLAP_TOKENS = 40
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+BLOCK_PATTERN = re.compile(r"[^\n]*\S[^\n]*(?:\n[^\n]*\S[^\n]*)*")
+SENTENCE_PATTERN = re.compile(r"[^.!?\s][^.!?\n]*(?:[.!?]+|$)", re.M)
+WORD_PATTERN = re.compile(r"\S+")
+UNDERLINE_PATTERN = re.compile(r"^\s*[=\-]{3,}\s*$")
+HEADER_PATTERN = re.compile(r"\AURL: (?P<url>[^\n]*)\nTitle: (?P<title>[^\n]*)\n=+\n")
+
+
+def approx_token_count(text):
+    """Rough token count (words + punctuation) used when no tokenizer is supplied"""
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def parse_header(text):
+    """Split the URL/Title header written by webcrawler.save_content off a document
+
+    Returns (url, title, body_offset); url and title are empty for other files.
+    """
+    match = HEADER_PATTERN.match(text)
+    if not match:
+        return "", "", 0
+    return match.group("url").strip(), match.group("title").strip(), match.end()
+
+
+def _split_long(text, start, end, max_tokens, count_tokens):
+    """Break an oversized span into (start, end, tokens) pieces, by sentence then by word"""
+    pieces = []
+    for pattern in (SENTENCE_PATTERN, WORD_PATTERN):
+        pieces = [(start + m.start(), start + m.end()) for m in pattern.finditer(text, 0, end - start)
+                  if m.group().strip()]
+        if all(count_tokens(text[s - start:e - start]) <= max_tokens for s, e in pieces):
+            break
+
+    packed = []
+    piece_start = piece_end = None
+    for s, e in pieces:
+        if piece_start is not None:
+            candidate = text[piece_start - start:e - start]
+            if count_tokens(candidate) <= max_tokens:
+                piece_end = e
+                continue
+            packed.append((piece_start, piece_end))
+        piece_start, piece_end = s, e
+    if piece_start is not None:
+        packed.append((piece_start, piece_end))
+
+    for s, e in packed:
+        yield s, e, count_tokens(text[s - start:e - start])
+
+
+def _text_block(text, start, end, max_tokens, count_tokens):
+    """Yield a ('text', start, end, tokens) block for a span, split if it is over budget"""
+    span = text[start:end]
+    start, end = start + len(span) - len(span.lstrip()), start + len(span.rstrip())
+    if start >= end:
+        return
+    block = text[start:end]
+    tokens = count_tokens(block)
+    if tokens <= max_tokens:
+        yield "text", start, end, tokens
+    else:
+        for s, e, n in _split_long(block, start, end, max_tokens, count_tokens):
+            yield "text", s, e, n
+
+
+def iter_blocks(text, offset=0, max_tokens=DEFAULT_MAX_TOKENS, count_tokens=approx_token_count):
+    """Yield ('heading', start, end, title) and ('text', start, end, tokens) blocks
+
+    Blocks are runs of non-blank lines. A line underlined with '=' (as written by
+    the crawler) is yielded as a section heading; text blocks larger than
+    max_tokens are split so every yielded block fits the budget.
+    """
+    for match in BLOCK_PATTERN.finditer(text, offset):
+        segment_start = line_start = match.start()
+        previous = None
+        for line in match.group().split("\n"):
+            line_end = line_start + len(line)
+            if previous and UNDERLINE_PATTERN.match(line) and not UNDERLINE_PATTERN.match(previous[2]):
+                yield from _text_block(text, segment_start, previous[0], max_tokens, count_tokens)
+                yield "heading", previous[0], line_end, previous[2].strip()
+                segment_start = line_end
+                previous = None
+            else:
+                previous = (line_start, line_end, line)
+            line_start = line_end + 1
+        yield from _text_block(text, segment_start, match.end(), max_tokens, count_tokens)
+
+
+def chunk_text(text, source, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS,
+               count_tokens=approx_token_count):
+    """Lazily split a document into overlapping, heading-aware chunks
+
+    Each chunk is a dict with 'text' (the section heading followed by the passage)
+    and 'metadata' (source, url, title, heading, chunk index and the start/end
+    character offsets of the passage in the original text). Chunks never span a
+    heading, and consecutive chunks in a section share up to overlap_tokens of text.
+    """
+    url, title, body_offset = parse_header(text)
+    heading = title
+    window = []  # (start, end, tokens) of the blocks in the current chunk
+    window_tokens = 0
+    index = 0
+
+    def make_chunk():
+        start, end = window[0][0], window[-1][1]
+        passage = text[start:end]
+        return {
+            "text": f"{heading}\n{passage}" if heading else passage,
+            "metadata": {
+                "source": source,
+                "url": url,
+                "title": title,
+                "heading": heading,
+                "chunk": index,
+                "start": start,
+                "end": end,
+            },
+        }
+
+    budget = max(max_tokens - count_tokens(heading), max_tokens // 2)
+    # Blocks are contiguous in the source, so splitting them as finely as the overlap
+    # costs nothing: they are packed back together up to the budget below
+    block_tokens = max(min(overlap_tokens, max_tokens // 2), 1)
+    for kind, start, end, value in iter_blocks(text, body_offset, block_tokens, count_tokens):
+        if kind == "heading":
+            if window:
+                yield make_chunk()
+                index += 1
+            window, window_tokens = [], 0
+            heading = value
+            budget = max(max_tokens - count_tokens(heading), max_tokens // 2)
+            continue
+
+        if window and window_tokens + value > budget:
+            yield make_chunk()
+            index += 1
+            # Carry trailing blocks into the next chunk, always dropping at least one
+            carried, carried_tokens = [], 0
+            for block in reversed(window[1:]):
+                if carried_tokens + block[2] > overlap_tokens or carried_tokens + block[2] + value > budget:
+                    break
+                carried.insert(0, block)
+                carried_tokens += block[2]
+            window, window_tokens = carried, carried_tokens
+
+        window.append((start, end, value))
+        window_tokens += value
+
+    if window:
+        yield make_chunk()
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+from sentence_transformers import SentenceTransformer
+
+# Configured once for both ingestion (chroma_db.py) and queries (RAGChain)
+DEFAULT_MODEL = os.environ.get("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+DEFAULT_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+
+# torch: plain fp32 PyTorch; onnx: ONNX Runtime fp32; onnx-int8: ONNX Runtime with the
+# dynamically quantized weights published alongside the model (needs optimum/onnxruntime)
+BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_INT8_FILE = os.environ.get("EMBEDDING_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+
+
+def load_model(model_name=DEFAULT_MODEL, backend=DEFAULT_BACKEND):
+    """Load a SentenceTransformer on CPU with the requested inference backend"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {BACKENDS}")
+    if backend == "torch":
+        return SentenceTransformer(model_name, device="cpu")
+    if backend == "onnx":
+        return SentenceTransformer(model_name, device="cpu", backend="onnx")
+    return SentenceTransformer(
+        model_name,
+        device="cpu",
+        backend="onnx",
+        model_kwargs={"file_name": ONNX_INT8_FILE}
+    )
+
+
+class EmbeddingEngine:
+    """Encodes text in bounded batches, optionally across a pool of worker processes
+
+    With workers > 1 a sentence-transformers multi-process pool is started on
+    first use; call close() (or use the engine as a context manager) to stop it.
+    The engine keeps running totals so callers can report throughput.
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL, backend=DEFAULT_BACKEND, batch_size=64, workers=1):
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+        self.model = load_model(model_name, backend)
+        self.pool = None
+        self.items = 0
+        self.seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+    @property
+    def tokenizer(self):
+        return self.model.tokenizer
+
+    def encode(self, texts):
+        """Embed a list of texts, returning a numpy array with one row per text"""
+        start = time.perf_counter()
+        if self.workers > 1 and len(texts) > self.batch_size:
+            if self.pool is None:
+                self.pool = self.model.start_multi_process_pool(["cpu"] * self.workers)
+            embeddings = self.model.encode_multi_process(texts, self.pool, batch_size=self.batch_size)
+        else:
+            embeddings = self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
+        self.seconds += time.perf_counter() - start
+        self.items += len(texts)
+        return embeddings
+
+    def iter_batches(self, items, text=lambda item: item):
+        """Yield (items, embeddings) for a stream of items, holding one window at a time
+
+        A window is batch_size items per worker, so every process has a full batch
+        to work on while memory stays bounded regardless of how long the stream is.
+        """
+        window_size = self.batch_size * self.workers
+        window = []
+        for item in items:
+            window.append(item)
+            if len(window) >= window_size:
+                yield window, self.encode([text(i) for i in window])
+                window = []
+        if window:
+            yield window, self.encode([text(i) for i in window])
+
+    def throughput(self):
+        """Items embedded per second of encoding time so far"""
+        return self.items / self.seconds if self.seconds else 0.0
+
+
+_shared_engines = {}
+_shared_lock = threading.Lock()
+
+
+def shared_engine(model_name=DEFAULT_MODEL, backend=DEFAULT_BACKEND):
+    """Return the process-wide engine for a model, loading and warming it up once"""
+    key = (model_name, backend)
+    with _shared_lock:
+        if key not in _shared_engines:
+            engine = EmbeddingEngine(model_name, backend=backend)
+            engine.encode(["warm up"])
+            _shared_engines[key] = engine
+        return _shared_engines[key]
+
+
+def record_embedding_model(collection, model_name=DEFAULT_MODEL):
+    """Store the embedding model name in the collection metadata"""
+    metadata = dict(collection.metadata or {})
+    if metadata.get("embedding_model") == model_name:
+        return
+    metadata["embedding_model"] = model_name
+    # The distance function cannot be passed to modify(), even unchanged
+    collection.modify(metadata={k: v for k, v in metadata.items() if not k.startswith("hnsw:")})
+
+
+def check_embedding_model(collection, model_name=DEFAULT_MODEL):
+    """Raise if the collection's vectors were written by a different embedding model"""
+    recorded = (collection.metadata or {}).get("embedding_model")
+    if recorded is None:
+        print(f"Warning: collection '{collection.name}' does not record its embedding model; "
+              f"assuming {model_name}. Re-run chroma_db.py to record it.")
+    elif recorded != model_name:
+        raise ValueError(
+            f"Collection '{collection.name}' was built with {recorded} but queries would use "
+            f"{model_name}; set EMBEDDING_MODEL={recorded} or rebuild with chroma_db.py --rebuild"
+        )
@@ -0,0 +1,14 @@
+import json
+import os
+
+def write_json(path, data, **dump_args):
+    """Write data to a JSON file atomically so an interrupted run never leaves it half written
+
+    The file is written next to path and moved into place; dump_args are passed to json.dump.
+    """
+    path = os.fspath(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, **dump_args)
+    os.replace(tmp_path, path)
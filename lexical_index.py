@@ -0,0 +1,95 @@
+import json
+import math
+import os
+import re
+import numpy as np
+from json_file import write_json
+
+# Written by chroma_db.py after every ingest, next to the vector store
+BM25_PATH = os.path.join("chroma_db", "bm25_index.json")
+
+# BM25 term frequency saturation and length normalisation
+K1 = 1.5
+B = 0.75
+
+# Rank constant of reciprocal rank fusion; 60 is the usual choice
+RRF_K = 60
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text):
+    """Lower-cased word tokens; maths terms like "sohcahtoa" or "surd" are kept whole"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """In-memory BM25 over the passages of the collection
+
+    Every posting's BM25 weight is precomputed when the index is loaded, so a
+    query is one vectorised add per query term plus a partial sort.
+    """
+
+    def __init__(self, ids, lengths, postings):
+        self.ids = ids
+        self.lengths = lengths
+        self.raw_postings = postings  # term -> flat [doc, tf, doc, tf, ...], as stored on disk
+        self.postings = {}  # term -> (doc indexes, weights)
+        count = len(ids)
+        average_length = (sum(lengths) / count if count else 0.0) or 1.0
+        doc_lengths = np.asarray(lengths, dtype=np.float32)
+        for term, flat in postings.items():
+            docs = np.asarray(flat[0::2], dtype=np.int32)
+            tf = np.asarray(flat[1::2], dtype=np.float32)
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = K1 * (1 - B + B * doc_lengths[docs] / average_length)
+            self.postings[term] = (docs, (idf * tf * (K1 + 1) / (tf + norm)).astype(np.float32))
+
+    @classmethod
+    def build(cls, ids, documents):
+        """Index (ids, documents) pairs, e.g. everything in the collection"""
+        lengths = []
+        postings = {}
+        for doc, text in enumerate(documents):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, []).extend((doc, tf))
+        return cls(list(ids), lengths, postings)
+
+    def search(self, query, top_k=10):
+        """Return [(id, score)] of the best top_k passages containing any query term"""
+        if not self.ids:
+            return []
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                docs, weights = posting
+                scores[docs] += weights  # each passage appears once per term
+        top_k = min(top_k, len(self.ids))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [(self.ids[i], float(scores[i])) for i in best if scores[i] > 0]
+
+    def save(self, path=BM25_PATH):
+        """Write the index to path"""
+        write_json(path, {"ids": self.ids, "lengths": self.lengths, "postings": self.raw_postings})
+
+    @classmethod
+    def load(cls, path=BM25_PATH):
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        return cls(data["ids"], data["lengths"], data["postings"])
+
+    def __len__(self):
+        return len(self.ids)
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Merge ranked id lists into one, scoring each id by sum(1 / (k + rank))"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,11 @@
+def parse_model_map(spec, convert=str):
+    """Parse a "model:value,model:value" setting into {model: convert(value)}
+
+    Used for per-model environment variables, e.g. MODEL_MAX_CONCURRENT="phi:2,gemma:1"
+    with convert=int. Values are split at the first colon, so they may contain more.
+    """
+    values = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, value = item.partition(":")
+        values[model.strip()] = convert(value.strip())
+    return values
@@ -0,0 +1,195 @@
+import os
+import sys
+import threading
+import time
+import requests
+from langchain_community.llms import Ollama
+from langchain_core.callbacks import BaseCallbackHandler
+from model_map import parse_model_map
+
+# Extra client settings per purpose; "quiz" uses a higher temperature so generated
+# questions vary between calls
+PURPOSES = {
+    "default": {},
+    "quiz": {"temperature": 0.7},
+}
+
+# How long Ollama keeps a model in memory after a request: a duration ("30m", "24h")
+# or seconds, negative to keep it loaded. Per model with MODEL_KEEP_ALIVE="phi:-1,gemma:10m"
+DEFAULT_KEEP_ALIVE = os.environ.get("DEFAULT_KEEP_ALIVE", "30m")
+# A generation whose model took longer than this to load counts as a cold start
+COLD_LOAD_SECONDS = 0.5
+
+def _keep_alive_value(value):
+    """Seconds as an int ("-1" keeps a model loaded for ever), else a duration such as "10m" as is"""
+    return int(value) if value.lstrip("-").isdigit() else value
+
+class GenerationMetrics(BaseCallbackHandler):
+    """Records model load time and time-to-first-token of every generation by one model
+
+    Ollama reports load and token counts in its final response, which the
+    client passes to on_llm_end; time-to-first-token is measured here for
+    streamed generations and taken from Ollama's load + prompt evaluation time
+    otherwise. If stage_metrics is given, every generation is also recorded
+    there, labelled with the route from its run_config().
+    """
+
+    run_inline = True
+
+    def __init__(self, model, stage_metrics=None):
+        self.model = model
+        self.stage_metrics = stage_metrics
+        self.lock = threading.Lock()
+        self.runs = {}  # run_id -> [started, first_token, route]
+        self.generations = 0
+        self.cold_starts = 0
+        self.load_seconds = 0.0
+        self.ttft_seconds = 0.0
+        self.max_ttft = 0.0
+        self.last = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        route = (metadata or {}).get("route", "other")
+        with self.lock:
+            self.runs[run_id] = [time.perf_counter(), None, route]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self.lock:
+            run = self.runs.get(run_id)
+            if run is not None and run[1] is None:
+                run[1] = time.perf_counter()
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self.lock:
+            self.runs.pop(run_id, None)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        now = time.perf_counter()
+        with self.lock:
+            run = self.runs.pop(run_id, None)
+        if run is None:
+            return
+        started, first_token, route = run
+        info = (response.generations[0][0].generation_info or {}) if response.generations else {}
+        load = info.get("load_duration", 0) / 1e9
+        if first_token is not None:
+            ttft = first_token - started
+        else:
+            ttft = load + info.get("prompt_eval_duration", 0) / 1e9
+        eval_seconds = info.get("eval_duration", 0) / 1e9
+        last = {
+            "load_seconds": round(load, 3),
+            "ttft_seconds": round(ttft, 3),
+            "total_seconds": round(now - started, 3),
+            "prompt_tokens": info.get("prompt_eval_count"),
+            "output_tokens": info.get("eval_count"),
+            "tokens_per_second": round(info.get("eval_count", 0) / eval_seconds, 1) if eval_seconds else None,
+        }
+        with self.lock:
+            self.generations += 1
+            self.cold_starts += load > COLD_LOAD_SECONDS
+            self.load_seconds += load
+            self.ttft_seconds += ttft
+            self.max_ttft = max(self.max_ttft, ttft)
+            self.last = last
+        if self.stage_metrics is not None:
+            labels = {"route": route, "model": self.model}
+            self.stage_metrics.observe("rag_time_to_first_token_seconds", ttft, **labels)
+            self.stage_metrics.observe("rag_tokens_per_second", last["tokens_per_second"], **labels)
+            self.stage_metrics.observe("rag_generation_seconds", now - started, **labels)
+        cold = f", loaded in {load:.1f}s" if load > COLD_LOAD_SECONDS else ""
+        print(f"{self.model}: first token after {ttft:.2f}s{cold}, {last['output_tokens']} tokens "
+              f"in {last['total_seconds']:.1f}s")
+
+    def stats(self):
+        with self.lock:
+            count = self.generations
+            return {
+                "generations": count,
+                "cold_starts": self.cold_starts,
+                "avg_load_seconds": round(self.load_seconds / count, 3) if count else None,
+                "avg_ttft_seconds": round(self.ttft_seconds / count, 3) if count else None,
+                "max_ttft_seconds": round(self.max_ttft, 3),
+                "last": self.last,
+            }
+
+class ModelRegistry:
+    """Pre-built Ollama clients, one per (model, purpose), shared by all requests
+
+    Clients are created once at startup and never mutated, so requests can pick
+    a model independently without affecting each other. Every client asks
+    Ollama to keep its model loaded for the model's keep_alive, and reports
+    load time and time-to-first-token to the model's GenerationMetrics.
+    """
+
+    def __init__(self, model_names, purposes=PURPOSES, keep_alive=None, default_keep_alive=DEFAULT_KEEP_ALIVE,
+                 stage_metrics=None):
+        self.model_names = list(model_names)
+        keep_alive = dict(keep_alive or {})
+        self.keep_alive = {name: keep_alive.get(name, default_keep_alive) for name in self.model_names}
+        self.metrics = {name: GenerationMetrics(name, stage_metrics) for name in self.model_names}
+        self.clients = {
+            (name, purpose): Ollama(
+                model=name,
+                keep_alive=self.keep_alive[name],
+                callbacks=[self.metrics[name]],
+                **options
+            )
+            for name in self.model_names
+            for purpose, options in purposes.items()
+        }
+
+    def __contains__(self, model_name):
+        return model_name in self.model_names
+
+    def get(self, model_name, purpose="default"):
+        """Return the client for a model; raises KeyError for unknown models or purposes"""
+        try:
+            return self.clients[(model_name, purpose)]
+        except KeyError:
+            raise KeyError(f"Model {model_name} not available") from None
+
+    def warm_up(self, model_name):
+        """Load a model into Ollama's memory ahead of the first request; returns the load time in seconds"""
+        client = self.get(model_name)
+        # A generate request without a prompt only loads the model
+        response = requests.post(
+            f"{client.base_url}/api/generate",
+            json={"model": model_name, "keep_alive": self.keep_alive[model_name]},
+            timeout=600
+        )
+        response.raise_for_status()
+        return response.json().get("load_duration", 0) / 1e9
+
+    def loaded(self, timeout=1.0):
+        """{model: whether Ollama has it in memory now}, or None if Ollama cannot be reached"""
+        try:
+            response = requests.get(f"{self.get(self.model_names[0]).base_url}/api/ps", timeout=timeout)
+            response.raise_for_status()
+            running = {model["name"].split(":")[0] for model in response.json().get("models", [])}
+        except (requests.RequestException, ValueError, IndexError):
+            return None
+        return {name: name in running for name in self.model_names}
+
+    def stats(self):
+        return {
+            name: dict(self.metrics[name].stats(), keep_alive=self.keep_alive[name])
+            for name in self.model_names
+        }
+
+def registry_from_env(model_names, stage_metrics=None):
+    """Build a ModelRegistry with keep-alive configured by MODEL_KEEP_ALIVE/DEFAULT_KEEP_ALIVE"""
+    return ModelRegistry(model_names, keep_alive=parse_model_map(os.environ.get("MODEL_KEEP_ALIVE", ""), _keep_alive_value),
+                         stage_metrics=stage_metrics)
+
+if __name__ == "__main__":
+    # Used by start.sh: python model_registry.py phi gemma
+    registry = registry_from_env(sys.argv[1:])
+    for name in registry.model_names:
+        started = time.perf_counter()
+        try:
+            load = registry.warm_up(name)
+            print(f"Warmed up {name} (keep_alive {registry.keep_alive[name]}): "
+                  f"loaded in {load:.1f}s, {time.perf_counter() - started:.1f}s total")
+        except Exception as e:
+            print(f"Could not warm up {name}: {e}")
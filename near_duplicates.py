@@ -0,0 +1,152 @@
+import json
+import os
+import re
+import threading
+import zlib
+import numpy as np
+from json_file import write_json
+
+# Documents are compared as sets of overlapping 5-word shingles
+SHINGLE_WORDS = 5
+# 64 MinHash values, split into 16 LSH bands of 4: pages sharing any band are compared
+NUM_PERM = 64
+BANDS = 16
+# Estimated Jaccard similarity of shingle sets above which a document is a near-duplicate
+DEFAULT_THRESHOLD = 0.85
+# Kept in the documents folder, next to the files it describes
+SIGNATURES_FILE = ".near_duplicates.json"
+# Fixed so signatures stay comparable between runs; stored with the index and checked on load
+SEED = 1
+
+WORD_PATTERN = re.compile(r"\w+")
+MERSENNE_PRIME = (1 << 61) - 1
+
+def _permutations(seed=SEED, num_perm=NUM_PERM):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+    b = rng.integers(0, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+    return a, b
+
+PERM_A, PERM_B = _permutations()
+
+def shingles(text):
+    """crc32 hashes of the lower-cased word 5-grams of a text"""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        words = [" ".join(words)] if words else []
+        return {zlib.crc32(w.encode("utf-8")) for w in words}
+    return {zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode("utf-8"))
+            for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def signature(text):
+    """MinHash signature of a text, or None if it has no words"""
+    hashed = shingles(text)
+    if not hashed:
+        return None
+    values = np.fromiter(hashed, dtype=np.uint64, count=len(hashed))
+    # a * h + b stays below 2**64 since a, b < 2**31 and h < 2**32
+    return ((PERM_A * values + PERM_B) % MERSENNE_PRIME).min(axis=1)
+
+def combine(signatures):
+    """Signature of a document from those of its parts, e.g. the pages of a PDF
+
+    A MinHash is a minimum over shingles, so this equals signature() of the
+    whole text except for the few shingles that span two parts.
+    """
+    signatures = [s for s in signatures if s is not None]
+    if not signatures:
+        return None
+    return np.minimum.reduce(signatures)
+
+class NearDuplicateIndex:
+    """Persistent MinHash signatures of documents, keyed by filename
+
+    find() uses locality-sensitive hashing on bands of the signature, so only
+    documents sharing a band are compared and a lookup stays fast however many
+    documents are indexed. Safe to use from several threads.
+    """
+
+    def __init__(self, path, threshold=DEFAULT_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.signatures = {}  # key -> signature
+        self.buckets = {}  # (band, band values) -> keys
+        self.lock = threading.Lock()
+        self.load()
+
+    def _bands(self, signature):
+        rows = NUM_PERM // BANDS
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(BANDS)]
+
+    def find(self, signature, exclude=None):
+        """Key of the most similar indexed document at or above the threshold, or None"""
+        if signature is None:
+            return None
+        with self.lock:
+            candidates = set()
+            for bucket in self._bands(signature):
+                candidates.update(self.buckets.get(bucket, ()))
+            candidates.discard(exclude)
+            best, best_similarity = None, self.threshold
+            for key in candidates:
+                similarity = float(np.mean(self.signatures[key] == signature))
+                if similarity >= best_similarity:
+                    best, best_similarity = key, similarity
+            return best
+
+    def add(self, key, signature):
+        """Index (or re-index) a document's signature under key"""
+        if signature is None:
+            return
+        with self.lock:
+            self._remove(key)
+            self.signatures[key] = signature
+            for bucket in self._bands(signature):
+                self.buckets.setdefault(bucket, set()).add(key)
+
+    def remove(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        # Caller holds the lock
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for bucket in self._bands(signature):
+            keys = self.buckets.get(bucket)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.buckets[bucket]
+
+    def keys(self):
+        with self.lock:
+            return set(self.signatures)
+
+    def load(self):
+        """Read the index from disk; an index built with other parameters is discarded"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        if data.get("params") != self._params():
+            print(f"Near-duplicate index {self.path} was built with other parameters, starting a new one")
+            return
+        for key, values in data["signatures"].items():
+            self.add(key, np.array(values, dtype=np.uint64))
+
+    def save(self):
+        """Write the index to its path"""
+        with self.lock:
+            data = {
+                "params": self._params(),
+                "signatures": {key: signature.tolist() for key, signature in self.signatures.items()},
+            }
+        write_json(self.path, data)
+
+    def _params(self):
+        return {"shingle_words": SHINGLE_WORDS, "num_perm": NUM_PERM, "bands": BANDS, "seed": SEED}
+
+    def __len__(self):
+        return len(self.signatures)
@@ -0,0 +1,120 @@
+import math
+import os
+import re
+import threading
+from collections import namedtuple
+from model_map import parse_model_map
+
+# num_ctx set in the Modelfiles
+CONTEXT_WINDOW = int(os.environ.get("OLLAMA_NUM_CTX", "4096"))
+# Kept free for the Modelfile's SYSTEM message (~250 tokens) and the answer
+RESERVED_TOKENS = int(os.environ.get("PROMPT_RESERVED_TOKENS", "1024"))
+# Optional exact counting with Hugging Face tokenizers, e.g.
+# "phi:microsoft/Phi-3-mini-4k-instruct,gemma:google/gemma-3-1b-it"
+TOKENIZERS = os.environ.get("PROMPT_TOKENIZERS", "")
+# A passage that would have to be cut shorter than this is dropped instead
+MIN_PASSAGE_TOKENS = 32
+
+CHAT_TEMPLATE = "Use the following context to answer the question concisely. Context: {context} \n Question: {query} \nAnswer:"
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+Prompt = namedtuple("Prompt", "text context tokens passages_used passages_total trimmed")
+
+class PromptTooLong(ValueError):
+    """Raised when a template and its fields alone (e.g. a student's answer) exceed the prompt budget"""
+
+def estimate_tokens(text):
+    """Conservative LLM token estimate when no tokenizer is configured
+
+    BPE vocabularies average about 4 characters per English token, but every
+    number and symbol in maths text tends to be its own token, so the larger
+    of the two counts is used.
+    """
+    return max(len(TOKEN_PATTERN.findall(text)), math.ceil(len(text) / 4))
+
+class TokenCounter:
+    """Counts tokens for a model with its Hugging Face tokenizer if one is configured
+
+    Tokenizers are loaded on first use; a model without one (or whose
+    tokenizer fails to load) falls back to estimate_tokens().
+    """
+
+    def __init__(self, tokenizers=None):
+        self.names = dict(tokenizers or {})
+        self.tokenizers = {}
+        self.lock = threading.Lock()
+
+    def _tokenizer(self, model):
+        with self.lock:
+            if model not in self.tokenizers:
+                tokenizer = None
+                if model in self.names:
+                    try:
+                        from transformers import AutoTokenizer
+                        tokenizer = AutoTokenizer.from_pretrained(self.names[model])
+                    except Exception as e:
+                        print(f"Could not load tokenizer {self.names[model]} for {model}, estimating tokens: {e}")
+                self.tokenizers[model] = tokenizer
+            return self.tokenizers[model]
+
+    def count(self, text, model):
+        tokenizer = self._tokenizer(model)
+        if tokenizer is None:
+            return estimate_tokens(text)
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
+class PromptBuilder:
+    """Fills a prompt template with as many retrieved passages as fit a token budget
+
+    Passages are taken in rank order. The first one that does not fit is cut
+    at a word boundary to the remaining budget (or dropped if that leaves
+    fewer than MIN_PASSAGE_TOKENS) and the rest are left out. A prompt whose
+    template and fields leave no budget at all is refused with PromptTooLong
+    rather than sent to overflow the model's context window.
+    """
+
+    def __init__(self, counter, max_prompt_tokens=CONTEXT_WINDOW - RESERVED_TOKENS):
+        self.counter = counter
+        self.max_prompt_tokens = max_prompt_tokens
+
+    def build(self, template, passages, model, **fields):
+        """Return a Prompt; template has a {context} field plus the given fields. Raises PromptTooLong"""
+        budget = self.max_prompt_tokens - self.counter.count(template.format(context="", **fields), model)
+        if budget < 0:
+            print(f"Prompt for {model} is {-budget} tokens over its budget of {self.max_prompt_tokens} "
+                  f"before any passages, refusing it")
+            raise PromptTooLong("The question or answer is too long, please shorten it")
+        chosen = []
+        trimmed = False
+        for passage in passages:
+            # Passages are joined by a newline, which costs about a token
+            tokens = self.counter.count(passage, model) + (1 if chosen else 0)
+            if tokens <= budget:
+                chosen.append(passage)
+                budget -= tokens
+                continue
+            if budget >= MIN_PASSAGE_TOKENS:
+                chosen.append(self._trim(passage, budget - 1, model))
+                trimmed = True
+            break
+
+        context = "\n".join(chosen)
+        text = template.format(context=context, **fields)
+        return Prompt(text, context, self.counter.count(text, model), len(chosen), len(passages), trimmed)
+
+    def _trim(self, passage, budget, model):
+        # Longest prefix ending at a word boundary that fits; binary search over word count
+        words = passage.split(" ")
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.counter.count(" ".join(words[:middle]), model) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        return " ".join(words[:low])
+
+def builder_from_env():
+    """Build a PromptBuilder configured by OLLAMA_NUM_CTX/PROMPT_* environment variables"""
+    return PromptBuilder(TokenCounter(parse_model_map(TOKENIZERS)), CONTEXT_WINDOW - RESERVED_TOKENS)
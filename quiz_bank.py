@@ -0,0 +1,164 @@
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+import numpy as np
+
+class QuestionBank:
+    """Pools of pre-generated quiz questions, refilled by a background thread
+
+    Questions are pooled per key (model and topic). take() pops a question in
+    O(1) and, when the pool drops below low_water, queues the key for a refill
+    up to target. Keys taken fewer than min_requests times are not refilled, so
+    one-off free-text topics do not keep generating questions. A generated question is discarded if its embedding has cosine
+    similarity >= similarity with one already pooled or recently served. At
+    most max_refills keys wait for a refill; further requests are dropped and
+    made again by a later take().
+
+    generate(key) must return a dict with at least a 'question'; embed(text)
+    returns its embedding.
+    """
+
+    def __init__(self, generate, embed, target=5, low_water=2, similarity=0.92, max_pools=200,
+                 max_attempts=3, max_refills=50, min_requests=2):
+        self.generate = generate
+        self.embed = embed
+        self.target = target
+        self.low_water = low_water
+        self.similarity = similarity
+        self.max_pools = max_pools
+        self.max_attempts = max_attempts
+        self.min_requests = min_requests
+        self.pools = OrderedDict()  # key -> deque of entries, least recently used first
+        self.served = {}  # key -> embeddings of recently served questions
+        self.requests = {}  # key -> times taken while its pool has been kept
+        self.lock = threading.Lock()
+        self.refills = queue.Queue(maxsize=max_refills)
+        self.pending = set()
+        self.generated = 0
+        self.duplicates = 0
+        self.hits = 0
+        self.misses = 0
+        self.dropped_refills = 0
+        self.worker = threading.Thread(target=self._run, name="quiz-bank", daemon=True)
+        self.worker.start()
+
+    def _pool(self, key):
+        # Caller holds the lock
+        if key not in self.pools:
+            self.pools[key] = deque()
+            self.served[key] = deque(maxlen=50)
+            self.requests[key] = 0
+            while len(self.pools) > self.max_pools:
+                old_key, _ = self.pools.popitem(last=False)
+                self.served.pop(old_key, None)
+                self.requests.pop(old_key, None)
+        self.pools.move_to_end(key)
+        return self.pools[key]
+
+    def take(self, key):
+        """Pop a pooled question for key, or None if the pool is empty; triggers a refill"""
+        with self.lock:
+            pool = self._pool(key)
+            entry = pool.popleft() if pool else None
+            if entry is not None:
+                self.served[key].append(entry["embedding"])
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.requests[key] += 1
+            needs_refill = len(pool) < self.low_water and self.requests[key] >= self.min_requests
+        if needs_refill:
+            self.request_refill(key)
+        return entry
+
+    def note_served(self, key, question):
+        """Record a question served outside the bank so it is not served again
+
+        Pooled near-duplicates (e.g. generated by a refill running at the same
+        time) are dropped, and later refills skip it.
+        """
+        embedding = self._normalized(question)
+        with self.lock:
+            pool = self._pool(key)
+            kept = [entry for entry in pool if float(np.dot(embedding, entry["embedding"])) < self.similarity]
+            self.duplicates += len(pool) - len(kept)
+            pool.clear()
+            pool.extend(kept)
+            self.served[key].append(embedding)
+
+    def request_refill(self, key):
+        with self.lock:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+        try:
+            self.refills.put_nowait(key)
+        except queue.Full:
+            with self.lock:
+                self.pending.discard(key)
+                self.dropped_refills += 1
+
+    def _normalized(self, text):
+        embedding = np.asarray(self.embed(text), dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def _is_duplicate(self, key, embedding):
+        # Caller holds the lock
+        known = [entry["embedding"] for entry in self.pools.get(key, ())]
+        known.extend(self.served.get(key, ()))
+        return any(float(np.dot(embedding, other)) >= self.similarity for other in known)
+
+    def _fill(self, key):
+        attempts = 0
+        while attempts < self.max_attempts:
+            with self.lock:
+                if len(self.pools.get(key, ())) >= self.target:
+                    return
+            entry = self.generate(key)
+            entry["embedding"] = self._normalized(entry["question"])
+            with self.lock:
+                if self._is_duplicate(key, entry["embedding"]):
+                    self.duplicates += 1
+                    attempts += 1
+                    continue
+                self._pool(key).append(entry)
+                self.generated += 1
+                attempts = 0
+
+    def _run(self):
+        while True:
+            key = self.refills.get()
+            try:
+                self._fill(key)
+            except Exception as e:
+                print(f"Error refilling question bank for {key}: {e}")
+            finally:
+                with self.lock:
+                    self.pending.discard(key)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "pools": len(self.pools),
+                "questions": sum(len(pool) for pool in self.pools.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "generated": self.generated,
+                "duplicates": self.duplicates,
+                "pending_refills": len(self.pending),
+                "dropped_refills": self.dropped_refills,
+            }
+
+def bank_from_env(generate, embed):
+    """Build a QuestionBank configured by QUIZ_BANK_* environment variables"""
+    return QuestionBank(
+        generate,
+        embed,
+        target=int(os.environ.get("QUIZ_BANK_SIZE", "5")),
+        low_water=int(os.environ.get("QUIZ_BANK_LOW_WATER", "2")),
+        similarity=float(os.environ.get("QUIZ_BANK_SIMILARITY", "0.92")),
+        max_refills=int(os.environ.get("QUIZ_BANK_MAX_REFILLS", "50")),
+        min_requests=int(os.environ.get("QUIZ_BANK_MIN_REQUESTS", "2")),
+    )
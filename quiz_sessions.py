@@ -0,0 +1,55 @@
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+class QuizSessionStore:
+    """Server-side state of asked quiz questions, referenced by a short token
+
+    Keeps the question, model, context passage ids and the already-resolved
+    context text, so the browser only has to send the token back with the
+    answer. At most max_sessions are kept (least recently used are dropped)
+    and each expires ttl seconds after it was last used.
+    """
+
+    def __init__(self, ttl=3600, max_sessions=5000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()  # token -> (session, expires_at)
+        self.lock = threading.Lock()
+
+    def create(self, question, model, doc_ids, context):
+        """Store a session and return its token"""
+        token = secrets.token_urlsafe(9)
+        session = {"question": question, "model": model, "doc_ids": list(doc_ids), "context": context}
+        with self.lock:
+            self.sessions[token] = (session, time.time() + self.ttl)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        return token
+
+    def get(self, token):
+        """Return the session for a token, or None if it is unknown or expired"""
+        now = time.time()
+        with self.lock:
+            item = self.sessions.get(token)
+            if item is None:
+                return None
+            session, expires_at = item
+            if expires_at < now:
+                del self.sessions[token]
+                return None
+            self.sessions[token] = (session, now + self.ttl)
+            self.sessions.move_to_end(token)
+            return session
+
+    def __len__(self):
+        return len(self.sessions)
+
+def store_from_env():
+    """Build a QuizSessionStore configured by QUIZ_SESSION_* environment variables"""
+    return QuizSessionStore(
+        ttl=float(os.environ.get("QUIZ_SESSION_TTL", "3600")),
+        max_sessions=int(os.environ.get("QUIZ_SESSION_MAX", "5000")),
+    )
@@ -1,39 +1,123 @@
 import os
+import threading
+from functools import lru_cache
 from langchain_community.llms import Ollama
 import chromadb
+from embedding import DEFAULT_BACKEND, DEFAULT_MODEL, check_embedding_model, shared_engine
+from lexical_index import BM25_PATH, BM25Index, reciprocal_rank_fusion
+from prompt_builder import CHAT_TEMPLATE, builder_from_env
+from response_cache import normalize_query
+
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+# "vector" (dense search only) or "hybrid" (dense and BM25, fused by reciprocal rank)
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "vector")
+# Candidates taken from each retriever before fusion
+HYBRID_CANDIDATES = 20
 
 class RAGChain:
-    def __init__(self, model_name="Phi"):
+    def __init__(self, model_name="Phi", embedding_model=DEFAULT_MODEL, embedding_backend=DEFAULT_BACKEND,
+                 query_cache_size=QUERY_CACHE_SIZE, retrieval_mode=RETRIEVAL_MODE):
         self.model_name = model_name
         self.ollama = Ollama(model=model_name)
         self.client = chromadb.PersistentClient(path="chroma_db")
+        # Queries are embedded by the same model as chroma_db.py, never by Chroma's default
         self.collection = self.client.get_or_create_collection(
             name="documents",
+            embedding_function=None
         )
-    
+        check_embedding_model(self.collection, embedding_model)
+        self.embedder = shared_engine(embedding_model, embedding_backend)
+        self._embed_normalized = lru_cache(maxsize=query_cache_size)(self._encode_query)
+        self.retrieval_mode = retrieval_mode
+        self.prompt_builder = builder_from_env()
+        # BM25 index, loaded on the first hybrid query and again whenever chroma_db.py rewrites it
+        self._lexical = None
+        self._lexical_mtime = None
+        self._lexical_lock = threading.Lock()
+
     def switch_model(self, new_model_name):
         """Switch to a different Ollama model"""
         self.model_name = new_model_name
         self.ollama = Ollama(model=new_model_name)
         print(f"Switched to model: {new_model_name}")
 
-    def retrieve(self, query, top_k=1):
+    def _encode_query(self, normalized_query):
+        embedding = self.embedder.encode([normalized_query])[0]
+        embedding.setflags(write=False)  # shared by every caller that hits the cache
+        return embedding
+
+    def embed_query(self, query):
+        """Embedding of a query, served from an LRU cache keyed on the normalized text"""
+        return self._embed_normalized(normalize_query(query))
+
+    def query_cache_info(self):
+        return self._embed_normalized.cache_info()
+
+    def lexical_index(self):
+        """The BM25 index written by chroma_db.py, or None if it has not been built"""
+        try:
+            mtime = os.path.getmtime(BM25_PATH)
+        except OSError:
+            mtime = None
+        with self._lexical_lock:
+            if self._lexical is None or mtime != self._lexical_mtime:
+                self._lexical_mtime = mtime
+                if mtime is not None:
+                    self._lexical = BM25Index.load(BM25_PATH)
+                    print(f"Loaded BM25 index of {len(self._lexical)} passages")
+                else:
+                    print(f"No BM25 index at {BM25_PATH}, run chroma_db.py; using vector retrieval only")
+                    self._lexical = False
+            return self._lexical or None
+
+    def retrieve_with_ids(self, query, top_k=1, mode=None):
+        """Return (ids, documents) of the top_k passages for a query
+
+        mode overrides the chain's retrieval_mode: "vector" or "hybrid".
+        """
+        if (mode or self.retrieval_mode) == "hybrid":
+            lexical = self.lexical_index()
+            if lexical is not None:
+                return self._retrieve_hybrid(query, top_k, lexical)
         results = self.collection.query(
-            query_texts=[query],
+            query_embeddings=[self.embed_query(query).tolist()],
             n_results=top_k,
             include=["documents"]
         )
-        return results["documents"][0]
+        return results["ids"][0], results["documents"][0]
+
+    def _retrieve_hybrid(self, query, top_k, lexical):
+        # Exact terms ("surd", "sohcahtoa") that the embedding model blurs are caught by BM25
+        candidates = max(top_k, HYBRID_CANDIDATES)
+        results = self.collection.query(
+            query_embeddings=[self.embed_query(query).tolist()],
+            n_results=candidates,
+            include=["documents"]
+        )
+        documents = dict(zip(results["ids"][0], results["documents"][0]))
+        lexical_ids = [doc_id for doc_id, _ in lexical.search(query, candidates)]
+        ids = reciprocal_rank_fusion([results["ids"][0], lexical_ids])[:top_k]
+
+        missing = [doc_id for doc_id in ids if doc_id not in documents]
+        if missing:
+            fetched = self.collection.get(ids=missing, include=["documents"])
+            documents.update(zip(fetched["ids"], fetched["documents"]))
+        # An id only BM25 knows was deleted since the index was built
+        ids = [doc_id for doc_id in ids if doc_id in documents]
+        return ids, [documents[doc_id] for doc_id in ids]
+
+    def retrieve(self, query, top_k=1):
+        return self.retrieve_with_ids(query, top_k)[1]
 
     def rag_ask_streaming(self, query):
         retrieved_docs = self.retrieve(query, top_k=2)
-        context = "\n".join(retrieved_docs)
-        prompt = f"Use the following context to answer the question concisely. Context: {context} \n Question: {query} \nAnswer:"
+        prompt = self.prompt_builder.build(CHAT_TEMPLATE, retrieved_docs, self.model_name.lower(), query=query)
+        print(f"Prompt: {prompt.tokens} tokens, {prompt.passages_used}/{prompt.passages_total} passages")
 
         print("Answer (streaming): ", end="", flush=True)
         try:
-            for chunk in self.ollama.stream(prompt):
+            for chunk in self.ollama.stream(prompt.text):
                 print(chunk, end="", flush=True)
         except AttributeError:
             print("\nStreaming is not supported by this Ollama implementation.")
-        print()
\ No newline at end of file
+        print()
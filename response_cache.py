@@ -0,0 +1,110 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+def normalize_query(query):
+    """Canonical form of a query for caching: case, spacing and end punctuation ignored"""
+    return re.sub(r"\s+", " ", query).strip().rstrip("?!.").strip().lower()
+
+EXACT_TERMS = re.compile(r"\d+(?:\.\d+)?|[=+\-*/^√]")
+
+def exact_terms(query):
+    """The numbers and operators in a query, in order, for the cache group key
+
+    Embeddings barely separate "simplify root 50" from "simplify root 72", so
+    questions only share cached answers when these match exactly.
+    """
+    return tuple(EXACT_TERMS.findall(query))
+
+class SemanticCache:
+    """Bounded, expiring cache of model responses keyed on meaning rather than exact text
+
+    Entries are grouped by a key (e.g. the route and model) plus the ids of the
+    documents retrieved for the request. A lookup hits when an entry in the same
+    group has a query embedding with cosine similarity >= threshold. Least
+    recently used entries are evicted once max_entries is reached.
+    """
+
+    def __init__(self, threshold=0.95, ttl=3600, max_entries=1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # entry id -> (group, embedding, response, expires_at)
+        self.groups = {}  # group -> set of entry ids
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _group(key, doc_ids):
+        return (tuple(key), tuple(doc_ids))
+
+    def _remove(self, entry_id):
+        group = self.entries.pop(entry_id)[0]
+        members = self.groups[group]
+        members.discard(entry_id)
+        if not members:
+            del self.groups[group]
+
+    def lookup(self, key, doc_ids, embedding):
+        """Return the cached response closest to embedding, or None on a miss"""
+        group = self._group(key, doc_ids)
+        now = time.time()
+        with self.lock:
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self.groups.get(group, ())):
+                _, cached_embedding, _, expires_at = self.entries[entry_id]
+                if expires_at < now:
+                    self._remove(entry_id)
+                    continue
+                score = float(np.dot(cached_embedding, embedding))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(best_id)
+            return self.entries[best_id][2]
+
+    def store(self, key, doc_ids, embedding, response):
+        if not response:
+            return
+        group = self._group(key, doc_ids)
+        with self.lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = (group, np.asarray(embedding), response, time.time() + self.ttl)
+            self.groups.setdefault(group, set()).add(entry_id)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.groups.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "evictions": self.evictions,
+            }
+
+def cache_from_env():
+    """Build a SemanticCache configured by RESPONSE_CACHE_* environment variables"""
+    return SemanticCache(
+        threshold=float(os.environ.get("RESPONSE_CACHE_THRESHOLD", "0.95")),
+        ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "3600")),
+        max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", "1000")),
+    )
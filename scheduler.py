@@ -0,0 +1,194 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict
+from model_map import parse_model_map
+
+# Lower runs first: students waiting on a chat answer beat quiz generation and grading.
+# Background work takes a slot only when nobody else is waiting, and at most
+# background_limit slots at once, so a request arriving later finds one free
+PRIORITY_CHAT = 0
+PRIORITY_QUIZ = 1
+PRIORITY_GRADING = 2
+PRIORITY_BACKGROUND = 3
+
+class QueueFull(Exception):
+    """Raised when a request arrives and the wait queue is already at max depth"""
+
+class QueueTimeout(Exception):
+    """Raised when a queued request is not admitted within the wait timeout"""
+
+class Ticket:
+    """A request's place in the admission queue
+
+    Once admitted the ticket holds a generation slot until release() is called;
+    releasing a ticket that is still queued just removes it from the queue.
+    """
+
+    def __init__(self, controller, model, priority, seq, deadline):
+        self.controller = controller
+        self.model = model
+        self.priority = priority
+        self.seq = seq
+        self.deadline = deadline
+        self.admitted = threading.Event()
+        self.released = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def position(self):
+        """1-based position among waiting requests, or 0 once admitted"""
+        return self.controller._position(self)
+
+    def check(self):
+        """Return position() without blocking; raises QueueTimeout past the deadline"""
+        position = self.position()
+        if position and time.monotonic() > self.deadline:
+            self.release()
+            raise QueueTimeout(f"Timed out waiting for model {self.model}")
+        return position
+
+    def positions(self, poll=1.0):
+        """Block until admitted, yielding the queue position each time it changes"""
+        last = None
+        while True:
+            position = self.check()
+            if not position:
+                return
+            if position != last:
+                yield position
+                last = position
+            self.admitted.wait(min(poll, max(self.deadline - time.monotonic(), 0)))
+
+    def wait(self):
+        """Block until admitted; raises QueueTimeout past the deadline"""
+        for _ in self.positions():
+            pass
+        return self
+
+    def release(self):
+        self.controller._release(self)
+
+class AdmissionController:
+    """Bounded, prioritised admission of generation requests to Ollama
+
+    At most total_limit generations run at once, and at most limits[model]
+    (default_limit if unset) for any one model. Requests beyond that wait in a
+    priority queue of at most max_queue entries for up to wait_timeout seconds.
+    PRIORITY_BACKGROUND requests hold at most background_limit slots (default
+    total_limit - 1, but at least 1).
+    """
+
+    def __init__(self, limits=None, default_limit=2, total_limit=2, max_queue=50, wait_timeout=120,
+                 background_limit=None):
+        self.limits = dict(limits or {})
+        self.default_limit = default_limit
+        self.total_limit = total_limit
+        self.background_limit = max(1, total_limit - 1) if background_limit is None else background_limit
+        self.max_queue = max_queue
+        self.wait_timeout = wait_timeout
+        self.lock = threading.Lock()
+        self.running = defaultdict(int)
+        self.total_running = 0
+        self.background_running = 0
+        self.waiting = defaultdict(list)  # model -> heap of tickets
+        self.waiting_count = 0
+        self.seq = itertools.count()
+        self.rejected = 0
+        self.timed_out = 0
+
+    def enqueue(self, model, priority=PRIORITY_CHAT):
+        """Queue a request for a model and return its Ticket; raises QueueFull"""
+        with self.lock:
+            if self.waiting_count >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull("Too many requests waiting for the model, please try again shortly")
+            ticket = Ticket(self, model, priority, next(self.seq), time.monotonic() + self.wait_timeout)
+            heapq.heappush(self.waiting[model], ticket)
+            self.waiting_count += 1
+            self._admit()
+            return ticket
+
+    def slot(self, model, priority=PRIORITY_CHAT):
+        """Wait for a generation slot; use as `with scheduler.slot(model): ...`"""
+        return self.enqueue(model, priority).wait()
+
+    def _limit(self, model):
+        return self.limits.get(model, self.default_limit)
+
+    def _admit(self):
+        # Caller holds the lock. Fill free slots with the best waiting ticket of any model.
+        # A heap whose best ticket is background work holds nothing else
+        background_full = self.background_running >= self.background_limit
+        while self.total_running < self.total_limit:
+            candidates = [heap[0] for model, heap in self.waiting.items()
+                          if heap and self.running[model] < self._limit(model)
+                          and not (background_full and heap[0].priority >= PRIORITY_BACKGROUND)]
+            if not candidates:
+                return
+            ticket = min(candidates)
+            heapq.heappop(self.waiting[ticket.model])
+            self.waiting_count -= 1
+            self.running[ticket.model] += 1
+            self.total_running += 1
+            if ticket.priority >= PRIORITY_BACKGROUND:
+                self.background_running += 1
+                background_full = self.background_running >= self.background_limit
+            ticket.admitted.set()
+
+    def _position(self, ticket):
+        with self.lock:
+            if ticket.admitted.is_set() or ticket.released:
+                return 0
+            return 1 + sum(1 for heap in self.waiting.values() for other in heap if other < ticket)
+
+    def _release(self, ticket):
+        with self.lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.admitted.is_set():
+                self.running[ticket.model] -= 1
+                self.total_running -= 1
+                if ticket.priority >= PRIORITY_BACKGROUND:
+                    self.background_running -= 1
+            else:
+                heap = self.waiting[ticket.model]
+                heap.remove(ticket)
+                heapq.heapify(heap)
+                self.waiting_count -= 1
+                if time.monotonic() > ticket.deadline:
+                    self.timed_out += 1
+            self._admit()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "running": dict(self.running),
+                "background_running": self.background_running,
+                "waiting": {model: len(heap) for model, heap in self.waiting.items()},
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+def controller_from_env():
+    """Build an AdmissionController configured by OLLAMA_*/QUEUE_* environment variables"""
+    total = int(os.environ.get("OLLAMA_MAX_CONCURRENT", "2"))
+    background = os.environ.get("QUEUE_BACKGROUND_MAX")
+    return AdmissionController(
+        limits=parse_model_map(os.environ.get("MODEL_MAX_CONCURRENT", ""), int),
+        default_limit=total,
+        total_limit=total,
+        background_limit=int(background) if background else None,
+        max_queue=int(os.environ.get("QUEUE_MAX_DEPTH", "50")),
+        wait_timeout=float(os.environ.get("QUEUE_TIMEOUT", "120")),
+    )
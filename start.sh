@@ -16,28 +16,43 @@ done
 
 echo "Ollama is ready!"
 
-# Pull base models first, then create custom models
+# Pull a base model unless it is already on disk, then create the custom model from its Modelfile
+prepare_model() {
+    local base=$1 name=$2 modelfile=$3
+    [ -f "$modelfile" ] || return 0
+    if ! ollama show "$base" > /dev/null 2>&1; then
+        echo "Pulling base $base model..."
+        ollama pull "$base" || true
+    fi
+    echo "Creating custom $name model..."
+    ollama create "$name" -f "$modelfile" || true
+}
+
+# Models are prepared in parallel; after a restart the base models are already pulled
 echo "Setting up models..."
-if [ -f "ModelFiles/Phi3_ModelFile" ]; then
-    echo "Pulling base phi3 model..."
-    ollama pull phi3 || true
-    echo "Creating custom phi model..."
-    ollama create phi -f ModelFiles/Phi3_ModelFile || true
-fi
-if [ -f "ModelFiles/SmolLLM2_Modelfile" ]; then
-    echo "Pulling base smollm2 model..."
-    ollama pull smollm2 || true
-    echo "Creating custom smoll model..."
-    ollama create smoll -f ModelFiles/SmolLLM2_Modelfile || true
-fi
-if [ -f "ModelFiles/Gemma3_ModelFile" ]; then
-    echo "Pulling base gemma3 model..."
-    ollama pull gemma3 || true
-    echo "Creating custom gemma model..."
-    ollama create gemma -f ModelFiles/Gemma3_ModelFile || true
+SETUP_STARTED=$SECONDS
+prepare_model phi3 phi ModelFiles/Phi3_ModelFile &
+PHI_PID=$!
+prepare_model smollm2 smoll ModelFiles/SmolLLM2_Modelfile &
+SMOL_PID=$!
+prepare_model gemma3 gemma ModelFiles/Gemma3_ModelFile &
+GEMMA_PID=$!
+wait $PHI_PID $SMOL_PID $GEMMA_PID
+echo "Models set up in $((SECONDS - SETUP_STARTED))s"
+
+# Load the models students will use first into memory (and keep them there for their
+# keep_alive), so the first request doesn't pay for a cold start. This runs alongside
+# the app's own startup; /readyz reports which models are loaded
+echo "Warming up models: ${WARM_MODELS:-phi}"
+python model_registry.py ${WARM_MODELS:-phi} &
+
+# Set ASYNC_SERVER=1 to serve through uvicorn (async streaming /chat) instead of Flask
+if [ "${ASYNC_SERVER:-0}" = "1" ]; then
+    echo "Starting ASGI app..."
+    exec uvicorn asgi:app --host 0.0.0.0 --port "${PORT:-5000}"
 fi
 
-echo "Models ready. Starting Flask app..."
+echo "Starting Flask app..."
 
 # Start Flask app in foreground
 exec python app.py
@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# How long a request that arrives during startup waits for a component before a 503
+STARTUP_WAIT = float(os.environ.get("STARTUP_WAIT", "60"))
+
+class NotReady(Exception):
+    """Raised when a component is still starting up (or failed to) when a request needs it"""
+
+class Startup:
+    """Initialises the app's heavy components on a background thread
+
+    Components are added as (name, init) and initialised in order once
+    start() is called, so the web server can listen (and answer /healthz)
+    straight away. get(name) returns a component, waiting for it if it is
+    still starting. How long each step took is kept for /readyz and printed
+    once all are done.
+    """
+
+    def __init__(self, started=None, wait=STARTUP_WAIT):
+        self.started = started if started is not None else time.perf_counter()
+        self.wait = wait
+        self.steps = OrderedDict()  # name -> {"init", "status", "seconds", "error", "done" event}
+        self.results = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, name, init):
+        self.steps[name] = {"init": init, "status": "pending", "seconds": None, "error": None,
+                            "done": threading.Event()}
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True, name="startup")
+                self.thread.start()
+
+    def _run(self):
+        imports = time.perf_counter() - self.started
+        for name, step in self.steps.items():
+            step["status"] = "starting"
+            started = time.perf_counter()
+            try:
+                self.results[name] = step["init"]()
+                step["status"] = "ready"
+            except Exception as e:
+                import traceback
+                print(f"Startup step {name} failed: {traceback.format_exc()}")
+                step["status"] = "failed"
+                step["error"] = str(e)
+            step["seconds"] = round(time.perf_counter() - started, 3)
+            step["done"].set()
+
+        breakdown = ", ".join(f"{name} {step['seconds']:.1f}s" + ("" if step["status"] == "ready" else " (failed)")
+                              for name, step in self.steps.items())
+        print(f"Startup: imports {imports:.1f}s, {breakdown}; "
+              f"{'ready' if self.ready() else 'NOT ready'} {time.perf_counter() - self.started:.1f}s after boot")
+
+    def get(self, name, timeout=None):
+        """The component called name, waiting up to timeout (default: wait) seconds; raises NotReady"""
+        step = self.steps[name]
+        if not step["done"].wait(self.wait if timeout is None else timeout):
+            raise NotReady(f"The app is still starting ({name}), please try again shortly")
+        if step["status"] != "ready":
+            raise NotReady(f"{name} failed to start: {step['error']}")
+        return self.results[name]
+
+    def ready(self):
+        return all(step["status"] == "ready" for step in self.steps.values())
+
+    def status(self):
+        return {
+            name: {"status": step["status"], "seconds": step["seconds"], "error": step["error"]}
+            for name, step in self.steps.items()
+        }
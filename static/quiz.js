@@ -45,7 +45,7 @@ async function generateQuestion() {
         
         if (response.ok) {
             currentQuestion = data.question;
-            currentContext = data.context;
+            currentQuizId = data.quiz_id;
             
             // Update model if changed
             if (data.model && data.model !== currentModel) {
@@ -126,9 +126,8 @@ async function submitAnswer() {
                 'Content-Type': 'application/json',
             },
             body: JSON.stringify({
-                question: currentQuestion,
+                quiz_id: currentQuizId,
                 answer: answer,
-                context: currentContext,
                 model: currentModel
             })
         });
@@ -194,7 +193,7 @@ function clearQuiz() {
         </div>
     `;
     currentQuestion = '';
-    currentContext = '';
+    currentQuizId = '';
     document.getElementById('topic-input').value = '';
 }
 
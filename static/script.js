@@ -89,6 +89,12 @@ async function sendMessage() {
                             }
                         }
                         
+                        if (data.queued) {
+                            // Waiting for a free model slot; replaced by the answer once it starts
+                            messageElement.textContent = `Waiting for the model... (position ${data.position} in queue)`;
+                            continue;
+                        }
+
                         if (data.error) {
                             // Remove loading spinner if present
                             const loadingSpinner = messageElement.querySelector('.loading');
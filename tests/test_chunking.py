@@ -0,0 +1,39 @@
+"""Section headings of chunks cut from pages as the crawler saves them"""
+from chunking import chunk_text
+from webcrawler import BBCBitesizeCrawler
+
+URL = "https://www.bbc.co.uk/bitesize/guides/zsm7v4j/revision/1"
+
+PAGE = """<html><head><title>BBC Bitesize - Surds</title></head><body>
+<nav><a href="/bitesize/subjects/z38pycw">Maths</a></nav>
+<main>
+<h1 class="page-title">Surds</h1>
+<h2>Simplifying surds</h2>
+<p>A surd is a square root which cannot be reduced to a whole number.</p>
+<p>To simplify a surd, look for the largest square number factor: the square root of 12 is 2 root 3.</p>
+<h2>Rationalising the denominator</h2>
+<p>To rationalise a denominator, multiply the top and bottom of the fraction by the surd.</p>
+<p>One over root 2 becomes root 2 over 2, which has a whole number denominator.</p>
+</main>
+<footer>BBC footer text here</footer>
+</body></html>"""
+
+def saved_page(tmp_path):
+    """The text the crawler writes to docs/ for PAGE"""
+    crawler = BBCBitesizeCrawler(output_dir=tmp_path)
+    title, content, _ = crawler.parse_page(PAGE, URL)
+    filename = crawler.save_content(title, content, URL)
+    return (tmp_path / filename).read_text(encoding="utf-8")
+
+def test_crawled_sections_keep_their_own_heading(tmp_path):
+    text = saved_page(tmp_path)
+    assert text.index("Simplifying surds") < text.index("A surd is") < text.index("Rationalising the denominator")
+
+    # Small chunks so every paragraph is a chunk of its own
+    chunks = list(chunk_text(text, "surds.txt", max_tokens=30, overlap_tokens=0))
+    assert len(chunks) == 4
+    for chunk in chunks:
+        passage = text[chunk["metadata"]["start"]:chunk["metadata"]["end"]]
+        expected = "Rationalising the denominator" if "denominator" in passage else "Simplifying surds"
+        assert chunk["metadata"]["heading"] == expected, passage
+        assert chunk["text"] == f"{expected}\n{passage}"
@@ -0,0 +1,34 @@
+"""Which quiz topics QuestionBank refills in the background"""
+from quiz_bank import QuestionBank
+
+class RecordingBank(QuestionBank):
+    """Records refill requests instead of generating questions"""
+
+    def __init__(self, **options):
+        super().__init__(generate=None, embed=None, **options)
+        self.refilled = []
+
+    def request_refill(self, key):
+        self.refilled.append(key)
+
+def test_one_off_topics_are_not_refilled():
+    bank = RecordingBank()
+    for topic in ("surds", "my homework question", "photosynthesis"):
+        assert bank.take(("phi3", topic)) is None
+    assert bank.refilled == []
+
+def test_repeated_topic_is_refilled():
+    bank = RecordingBank()
+    bank.take(("phi3", "surds"))
+    bank.take(("gemma", "surds"))
+    assert bank.refilled == []
+
+    bank.take(("phi3", "surds"))
+    assert bank.refilled == [("phi3", "surds")]
+
+def test_evicted_topic_starts_counting_again():
+    bank = RecordingBank(max_pools=1)
+    bank.take(("phi3", "surds"))
+    bank.take(("phi3", "photosynthesis"))
+    bank.take(("phi3", "surds"))
+    assert bank.refilled == []
@@ -0,0 +1,186 @@
+"""Incremental and near-duplicate behaviour of chroma_db.sync_folder
+
+The embedding model is replaced by a hashed bag of words, so these run
+without downloading it; each test gets its own folder, store and manifest.
+"""
+import json
+import os
+import zlib
+import numpy as np
+import pytest
+
+chromadb = pytest.importorskip("chromadb")
+
+SURDS = ("A surd is a square root which cannot be reduced to a whole number. To simplify a surd look "
+         "for the largest square number factor, so the square root of twelve is two root three. ") * 3
+PYTHAGORAS = ("In a right angled triangle the square on the hypotenuse equals the sum of the squares on "
+              "the other two sides, which finds a missing side when two are known. ") * 3
+QUADRATICS = ("A quadratic equation can be solved by factorising, completing the square or using the "
+              "quadratic formula, and has at most two real roots. ") * 3
+
+class WordEngine:
+    """Stands in for the embedding engine; records which files it embedded"""
+
+    def __init__(self):
+        self.tokenizer = self
+        self.items = 0
+        self.seconds = 0.0
+        self.embedded = set()
+
+    def tokenize(self, text):
+        return text.split()
+
+    def iter_batches(self, items, text=lambda item: item):
+        for item in items:
+            self.items += 1
+            self.embedded.add(item["metadata"]["source"])
+            vector = np.zeros(32, dtype=np.float32)
+            for word in text(item).split():
+                vector[zlib.crc32(word.encode("utf-8")) % 32] += 1
+            yield [item], (vector / np.linalg.norm(vector))[None, :]
+
+    def throughput(self):
+        return 0.0
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    """chroma_db working in tmp_path; sync() runs sync_folder on docs/ and returns the files it embedded"""
+    monkeypatch.chdir(tmp_path)
+    import chroma_db
+
+    engine = WordEngine()
+    client = chromadb.PersistentClient(path=str(tmp_path / "chroma_db"))
+    monkeypatch.setattr(chroma_db, "engine", engine)
+    monkeypatch.setattr(chroma_db, "collection", client.get_or_create_collection("documents", embedding_function=None))
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    manifest_path = str(tmp_path / "chroma_db" / "ingest_manifest.json")
+
+    class Index:
+        folder = docs
+
+        def write(self, filename, text):
+            (docs / filename).write_text(text, encoding="utf-8")
+
+        def sync(self):
+            engine.embedded = set()
+            chroma_db.sync_folder(str(docs), manifest_path=manifest_path, read_workers=2)
+            return engine.embedded
+
+        def manifest(self):
+            with open(manifest_path, "r", encoding="utf-8") as file:
+                return json.load(file)["files"]
+
+        def sources(self):
+            return {metadata["source"] for metadata in chroma_db.collection.get()["metadatas"]}
+
+    return Index()
+
+def test_unchanged_and_touched_files_are_not_embedded_again(index):
+    index.write("surds.txt", SURDS)
+    index.write("pythagoras.txt", PYTHAGORAS)
+    assert index.sync() == {"surds.txt", "pythagoras.txt"}
+    assert index.sync() == set()
+
+    path = index.folder / "surds.txt"
+    os.utime(path, (path.stat().st_atime, path.stat().st_mtime + 10))
+    assert index.sync() == set()
+
+def test_edited_and_deleted_files_replace_their_chunks(index):
+    index.write("surds.txt", SURDS)
+    index.write("pythagoras.txt", PYTHAGORAS)
+    index.sync()
+    old_ids = index.manifest()["surds.txt"]["ids"]
+
+    index.write("surds.txt", QUADRATICS)
+    (index.folder / "pythagoras.txt").unlink()
+    assert index.sync() == {"surds.txt"}
+
+    manifest = index.manifest()
+    assert set(manifest) == {"surds.txt"}
+    assert not set(old_ids) & set(manifest["surds.txt"]["ids"])
+    assert index.sources() == {"surds.txt"}
+
+def test_near_duplicate_is_skipped(index):
+    index.write("surds.txt", SURDS)
+    index.write("surds_copy.txt", SURDS + "Revision notes.")
+    assert index.sync() == {"surds.txt"}
+    assert index.manifest()["surds_copy.txt"]["duplicate_of"] == "surds.txt"
+    assert index.sources() == {"surds.txt"}
+
+def test_copy_is_indexed_once_its_original_is_edited(index):
+    index.write("b_surds.txt", SURDS)
+    index.sync()
+    # Added later but sorting first, so it is read before the edited original below
+    index.write("a_surds_copy.txt", SURDS)
+    assert index.sync() == set()
+    assert index.manifest()["a_surds_copy.txt"]["duplicate_of"] == "b_surds.txt"
+
+    index.write("b_surds.txt", PYTHAGORAS)
+    assert index.sync() == {"a_surds_copy.txt", "b_surds.txt"}
+    assert "duplicate_of" not in index.manifest()["a_surds_copy.txt"]
+    assert index.sources() == {"a_surds_copy.txt", "b_surds.txt"}
+    assert index.sync() == set()
+
+def test_copy_is_indexed_once_its_original_is_deleted(index):
+    index.write("surds.txt", SURDS)
+    index.write("surds_copy.txt", SURDS)
+    index.sync()
+
+    (index.folder / "surds.txt").unlink()
+    assert index.sync() == {"surds_copy.txt"}
+    assert index.sources() == {"surds_copy.txt"}
+
+def test_exact_copy_is_never_stored_over_its_original(index):
+    index.write("pythagoras.txt", PYTHAGORAS)
+    index.sync()
+    original_ids = index.manifest()["pythagoras.txt"]["ids"]
+
+    # Without signatures only the content hash can tell it is a copy
+    (index.folder / ".near_duplicates.json").unlink()
+    index.write("pythag_copy.txt", PYTHAGORAS)
+    assert index.sync() == set()
+    manifest = index.manifest()
+    assert manifest["pythag_copy.txt"]["duplicate_of"] == "pythagoras.txt"
+    assert manifest["pythag_copy.txt"]["ids"] == []
+    assert manifest["pythagoras.txt"]["ids"] == original_ids
+    assert index.sources() == {"pythagoras.txt"}
+
+def test_missing_signatures_are_computed_for_indexed_files(index):
+    index.write("surds.txt", SURDS)
+    index.sync()
+
+    (index.folder / ".near_duplicates.json").unlink()
+    index.write("surds_notes.txt", SURDS + "Revision notes.")
+    assert index.sync() == set()
+    assert index.manifest()["surds_notes.txt"]["duplicate_of"] == "surds.txt"
+    assert (index.folder / ".near_duplicates.json").exists()
+
+def test_streamed_near_duplicate_is_removed_after_embedding(index, monkeypatch):
+    import chroma_db
+
+    # Every file streams, as a PDF longer than the page queue does
+    monkeypatch.setattr(chroma_db, "PAGE_QUEUE_PAGES", 0)
+    index.write("surds.txt", SURDS)
+    index.sync()
+
+    index.write("surds_notes.txt", SURDS + "Revision notes.")
+    assert index.sync() == {"surds_notes.txt"}
+    assert index.manifest()["surds_notes.txt"]["duplicate_of"] == "surds.txt"
+    assert index.manifest()["surds_notes.txt"]["ids"] == []
+    assert index.sources() == {"surds.txt"}
+
+def test_streamed_exact_copy_is_never_embedded(index, monkeypatch):
+    import chroma_db
+
+    monkeypatch.setattr(chroma_db, "PAGE_QUEUE_PAGES", 0)
+    index.write("surds.txt", SURDS)
+    index.sync()
+
+    index.write("surds_copy.txt", SURDS)
+    assert index.sync() == set()
+    assert index.manifest()["surds_copy.txt"]["duplicate_of"] == "surds.txt"
+    assert index.sources() == {"surds.txt"}
@@ -1,35 +1,295 @@
-import os
+import argparse
+import hashlib
+import heapq
+import itertools
+import json
+import queue
 import requests
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml.etree import ParserError
 from urllib.parse import urljoin, urlparse
+import threading
 import time
 import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
+from json_file import write_json
+from near_duplicates import SIGNATURES_FILE, NearDuplicateIndex, signature
+
+# Checkpoint of the crawl (frontier, visited pages, per-URL validators), kept in the output folder
+CRAWL_STATE_FILE = ".crawl_state.json"
+# How many crawled pages between checkpoints
+CHECKPOINT_EVERY = 25
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Patterns used on every page, compiled once
+WHITESPACE_RE = re.compile(r'\s+')
+TITLE_CLASS_RE = re.compile(r'title|heading', re.I)
+TITLE_PREFIX_RE = re.compile(r'^\s*BBC\s+Bitesize\s*[-–—]\s*', re.I)
+CONTENT_CLASS_RE = re.compile(r'content|main|article|text|body|guide|topic|revision', re.I)
+CONTENT_ID_RE = re.compile(r'content|main|article|body', re.I)
+CONTENT_TESTID_RE = re.compile(r'content|article|main', re.I)
+UNSAFE_FILENAME_RE = re.compile(r'[^\w\s-]')
+FILENAME_SEPARATOR_RE = re.compile(r'[-\s]+')
+
+# Script, style, navigation and other UI elements never hold learning material
+STRIP_XPATH = '//script|//style|//nav|//header|//footer|//aside|//button|//form'
+HEADING_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+TEXT_TAGS = ('p', 'li', 'dd', 'dt', 'blockquote')
+
+# Sections that don't contain learning material
+# (revision pages are kept even if they match, as they contain actual learning content)
+EXCLUDE_PATTERNS = (
+    '/quizzes/', '/quiz/',  # Quiz pages (we want the actual content)
+    '/games/', '/game/',
+    '/images/', '/image/',
+    '/downloads/', '/download/',
+    '/print/', '/share/',
+    '/search',
+    '/topics?page=',
+    '/articles/',  # Article listings, not content
+    '/videos/', '/video/',  # Video pages (optional - remove if you want videos)
+    '/my-bitesize',
+    '/sign-in',
+    '/register',
+    '/about',
+    '/contact',
+    '/terms',
+    '/privacy',
+    '/cookies',
+    '/accessibility',
+    '/help',
+    '/jobs',
+    '/podcasts',
+    '/radio',
+    '/skillswise',
+    '/external',
+    '?page=',
+    '#',  # Anchors
+)
+N5_KEYWORDS = ('national-5', 'national5', 'n5', 'national 5')
+MATH_KEYWORDS = ('maths', 'mathematics', 'math')
+# BBC Bitesize content URLs often look like:
+# /guides/[code]/revision/[number] - revision material pages
+# /guides/..., /topics/..., /revision/..., /learn/...
+CONTENT_PATHS = ('/guides/', '/topics/', '/revision/', '/learn/', '/study/', '/bitesize/guides/', '/bitesize/topics/')
+
+class TokenBucket:
+    """Rate limiter allowing `rate` requests per second on average, in bursts of up to `burst`"""
+    
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until a request may be made"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+def link_priority(url):
+    """Priority tier of a URL, lower is fetched first
+    
+    Revision pages hold the actual learning material, guides and topics pages
+    lead to them, and anything else relevant comes last.
+    """
+    url_lower = url.lower()
+    if '/revision/' in url_lower and '/guides/' in url_lower:
+        return 0
+    if '/guides/' in url_lower or '/topics/' in url_lower:
+        return 1
+    return 2
+
+class CrawlFrontier:
+    """URLs waiting to be crawled, popped by (priority tier, depth, discovery order)
+    
+    Every URL ever pushed is remembered in a set, so re-discovering a link is
+    an O(1) check and each URL is queued at most once; push and pop are
+    O(log n) on the heap.
+    """
+    
+    def __init__(self):
+        self.heap = []
+        self.seen = set()
+        self.seq = itertools.count()
+    
+    def push(self, url, depth=0):
+        """Queue a URL; returns False if it was already seen"""
+        if url in self.seen:
+            return False
+        self.seen.add(url)
+        heapq.heappush(self.heap, (link_priority(url), depth, next(self.seq), url))
+        return True
+    
+    def pop(self):
+        """Return the (url, depth) to crawl next"""
+        _, depth, _, url = heapq.heappop(self.heap)
+        return url, depth
+    
+    def mark_seen(self, url):
+        """Remember a URL (e.g. already crawled) so it is never queued"""
+        self.seen.add(url)
+    
+    def items(self):
+        """Queued [url, depth] pairs in crawl order, for checkpointing"""
+        return [[url, depth] for _, depth, _, url in sorted(self.heap)]
+    
+    def __contains__(self, url):
+        return url in self.seen
+    
+    def __len__(self):
+        return len(self.heap)
+
+class IndexPipeline:
+    """Embeds saved pages into the vector index on a background thread while the crawl runs
+    
+    Pages wait in a bounded queue: if embedding falls behind, crawl workers
+    block on put() rather than piling pages up in memory. close() waits for
+    the last batch to be stored.
+    """
+    
+    def __init__(self, folder="docs", max_pending=256):
+        self.folder = folder
+        self.pages = queue.Queue(maxsize=max_pending)
+        self.indexed = 0
+        self.failed = False
+        self.thread = threading.Thread(target=self._run, name="index-pipeline", daemon=True)
+        self.thread.start()
+    
+    def _iter_pages(self):
+        while True:
+            page = self.pages.get()
+            if page is None:
+                return
+            yield page
+    
+    def _run(self):
+        try:
+            # Imported here: it opens ChromaDB and loads the embedding model
+            import chroma_db
+            self.indexed = chroma_db.index_pages(self._iter_pages(), folder_path=self.folder)
+        except Exception as e:
+            print(f"Error indexing crawled pages, run chroma_db.py afterwards to index them: {e}")
+            self.failed = True
+            # Keep draining so crawl workers never block on a full queue
+            for _ in self._iter_pages():
+                pass
+    
+    def put(self, filename, text):
+        """Queue a saved page (its filename and the exact text written) for indexing"""
+        self.pages.put((filename, text))
+    
+    def close(self):
+        self.pages.put(None)
+        self.thread.join()
 
 class BBCBitesizeCrawler:
-    def __init__(self, base_url="https://www.bbc.co.uk/bitesize", output_dir="docs"):
+    def __init__(self, base_url="https://www.bbc.co.uk/bitesize", output_dir="docs",
+                 requests_per_second=1.0, burst=1, workers=4, state_path=None, pipeline=None):
         self.base_url = base_url
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+        # requests.Session is not thread-safe, so each worker thread gets its own
+        self.local = threading.local()
         self.visited_urls = set()
         self.scraped_count = 0
-        
+        # Rate limiting - be respectful: requests_per_second per host, shared by all workers
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.rate_limiters = {}
+        self.workers = workers
+        self.lock = threading.Lock()
+        # Per-URL record from earlier crawls: ETag, Last-Modified, content hash, output
+        # filename and links, so unchanged pages are revalidated instead of re-downloaded
+        self.state_path = Path(state_path) if state_path else self.output_dir / CRAWL_STATE_FILE
+        self.pages = self.load_state()["pages"]
+        self.unchanged_count = 0
+        # Optional IndexPipeline that saved pages are also sent to
+        self.pipeline = pipeline
+        # The same revision text is served under several URLs; only the first copy is saved
+        self.duplicates = NearDuplicateIndex(str(self.output_dir / SIGNATURES_FILE))
+        self.duplicate_count = 0
+        # Held from the duplicate check until the page's signature is added, so two
+        # workers can't both save copies of the same text
+        self.duplicate_lock = threading.Lock()
+    
+    @property
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+            self.local.session.headers.update({'User-Agent': USER_AGENT})
+        return self.local.session
+    
+    def rate_limiter(self, url):
+        """Token bucket for the host of a URL"""
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.rate_limiters:
+                self.rate_limiters[host] = TokenBucket(self.requests_per_second, self.burst)
+            return self.rate_limiters[host]
+        
+    def load_state(self):
+        """Read the checkpoint left by an earlier crawl, or an empty one"""
+        if not self.state_path.exists():
+            return {"pages": {}, "frontier": [], "visited": [], "scraped_count": 0}
+        with open(self.state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def save_state(self, frontier, in_flight=()):
+        """Checkpoint the crawl to state_path
+        
+        Pages still being processed are put back on the frontier, so a resumed
+        crawl fetches them again.
+        """
+        in_flight = list(in_flight)
+        with self.lock:
+            state = {
+                "pages": dict(self.pages),
+                "frontier": [[url, depth] for url, depth in in_flight] + frontier.items(),
+                "visited": sorted(self.visited_urls - {url for url, _ in in_flight}),
+                "scraped_count": self.scraped_count,
+            }
+        write_json(self.state_path, state, indent=1, sort_keys=True)
+        self.duplicates.save()
+    
     def fetch_page(self, url, retries=3):
-        """Fetch a page with retry logic and rate limiting"""
-        if url in self.visited_urls:
-            return None
+        """Fetch a page with retry logic and rate limiting
+        
+        Returns the response, or None on failure. If an earlier crawl recorded
+        the page, the request is conditional and may come back as a 304.
+        """
+        with self.lock:
+            if url in self.visited_urls:
+                return None
+        
+        headers = {}
+        record = self.pages.get(url)
+        if record and (not record['filename'] or (self.output_dir / record['filename']).exists()):
+            if record.get('etag'):
+                headers['If-None-Match'] = record['etag']
+            if record.get('last_modified'):
+                headers['If-Modified-Since'] = record['last_modified']
             
         for attempt in range(retries):
             try:
-                time.sleep(1)  # Rate limiting - be respectful
-                response = self.session.get(url, timeout=10)
-                response.raise_for_status()
-                self.visited_urls.add(url)
-                return response.text
+                self.rate_limiter(url).acquire()
+                response = self.session.get(url, timeout=10, headers=headers)
+                if response.status_code != 304:
+                    response.raise_for_status()
+                with self.lock:
+                    self.visited_urls.add(url)
+                return response
             except requests.RequestException as e:
                 print(f"Error fetching {url} (attempt {attempt + 1}/{retries}): {e}")
                 if attempt < retries - 1:
@@ -43,72 +303,86 @@ class BBCBitesizeCrawler:
         if not text:
             return ""
         # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text)
-        # Remove special characters but keep basic punctuation
-        text = text.strip()
-        return text
+        return WHITESPACE_RE.sub(' ', text).strip()
     
-    def extract_content(self, html, url):
-        """Extract main content from a BBC Bitesize page"""
-        soup = BeautifulSoup(html, 'html.parser')
-        
-        # Remove script and style elements
-        for script in soup(["script", "style", "nav", "header", "footer", "aside"]):
-            script.decompose()
+    def parse_page(self, html, url):
+        """Extract (title, content, links) from a BBC Bitesize page, parsing it only once"""
+        try:
+            doc = lxml.html.document_fromstring(html)
+        except ParserError:
+            # Empty document
+            return "", "", set()
+        except ValueError:
+            # lxml refuses str input with an XML encoding declaration; parse the bytes instead
+            doc = lxml.html.document_fromstring(html.encode('utf-8'), parser=lxml.html.HTMLParser(encoding='utf-8'))
         
-        # Remove common navigation and UI elements
-        for elem in soup.find_all(['nav', 'header', 'footer', 'aside', 'button', 'form']):
-            elem.decompose()
+        # Links are taken from the whole page, navigation included, so find them before it is stripped
+        links = self._find_links(doc, url)
         
-        # Try to find main content area - BBC Bitesize uses various structures
-        content = []
-        title = ""
-        
-        # Try to find title - BBC Bitesize often uses h1 or specific title classes
-        title_elem = (
-            soup.find('h1', class_=re.compile(r'title|heading', re.I)) or
-            soup.find('h1') or
-            soup.find('title')
-        )
-        if title_elem:
-            title = self.clean_text(title_elem.get_text())
-            # Remove "BBC Bitesize" prefix if present
-            title = re.sub(r'^\s*BBC\s+Bitesize\s*[-–—]\s*', '', title, flags=re.I)
+        for elem in doc.xpath(STRIP_XPATH):
+            elem.drop_tree()
         
+        return self._find_title(doc), self._find_content(doc), links
+    
+    def extract_content(self, html, url):
+        """Extract main content from a BBC Bitesize page"""
+        title, content, _ = self.parse_page(html, url)
+        return title, content
+    
+    def find_links(self, html, base_url):
+        """Find all relevant links on a page"""
+        return self.parse_page(html, base_url)[2]
+    
+    def _find_title(self, doc):
+        # BBC Bitesize often uses h1 or specific title classes
+        title_elem = next((h1 for h1 in doc.iter('h1') if TITLE_CLASS_RE.search(h1.get('class', ''))), None)
+        if title_elem is None:
+            title_elem = doc.find('.//h1')
+        if title_elem is None:
+            title_elem = doc.find('.//title')
+        if title_elem is None:
+            return ""
+        # Remove "BBC Bitesize" prefix if present
+        return TITLE_PREFIX_RE.sub('', self.clean_text(title_elem.text_content()))
+    
+    def _find_main(self, doc):
         # Look for main content in common BBC Bitesize structures
-        # BBC Bitesize often uses specific classes for content
-        main_content = (
-            soup.find('main') or
-            soup.find('article') or
-            soup.find('div', class_=re.compile(r'content|main|article|text|body|guide|topic|revision', re.I)) or
-            soup.find('div', id=re.compile(r'content|main|article|body', re.I)) or
-            soup.find('div', {'data-testid': re.compile(r'content|article|main', re.I)})
-        )
-        
-        if main_content:
-            # Extract structured content
-            # Get headings first to maintain structure
-            headings = main_content.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
-            for heading in headings:
-                text = self.clean_text(heading.get_text())
-                if text and len(text) > 3:
-                    content.append(f"\n{text}\n{'=' * len(text)}\n")
-            
-            # Extract paragraphs, lists, and other content
-            for elem in main_content.find_all(['p', 'li', 'dd', 'dt', 'blockquote']):
-                text = self.clean_text(elem.get_text())
-                if text and len(text) > 10:  # Filter out very short text
-                    # Avoid duplicates if we already have it as a heading
-                    if not any(text in existing for existing in content[-5:]):
+        for path in ('.//main', './/article'):
+            elem = doc.find(path)
+            if elem is not None:
+                return elem
+        for attribute, pattern in (('class', CONTENT_CLASS_RE), ('id', CONTENT_ID_RE), ('data-testid', CONTENT_TESTID_RE)):
+            for elem in doc.iter('div'):
+                if pattern.search(elem.get(attribute, '')):
+                    return elem
+        return None
+    
+    def _find_content(self, doc):
+        content = []
+        main_content = self._find_main(doc)
+        
+        if main_content is not None:
+            # Headings and text in document order, so each section's text follows its
+            # heading and chunking labels passages with the section they are in
+            paragraphs = []
+            for elem in main_content.iter(*HEADING_TAGS, *TEXT_TAGS):
+                text = self.clean_text(elem.text_content())
+                if elem.tag in HEADING_TAGS:
+                    if text and len(text) > 3:
+                        content.append(f"\n{text}\n{'=' * len(text)}\n")
+                elif text and len(text) > 10:  # Filter out very short text
+                    # Text already in one of the last few paragraphs repeats it (e.g. a <p> in an <li>)
+                    if not any(text in existing for existing in paragraphs[-5:]):
+                        paragraphs.append(text)
                         content.append(text)
         else:
             # Fallback: get all paragraphs and headings
-            for elem in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'li']):
-                text = self.clean_text(elem.get_text())
+            for elem in doc.iter(*HEADING_TAGS, 'p', 'li'):
+                text = self.clean_text(elem.text_content())
                 if text and len(text) > 10:
                     content.append(text)
         
-        # Clean up content - remove duplicates and empty strings
+        # Remove duplicates, and anything too short to be useful (including short headings)
         cleaned_content = []
         seen = set()
         for item in content:
@@ -116,17 +390,13 @@ class BBCBitesizeCrawler:
             if item_lower and item_lower not in seen and len(item_lower) > 10:
                 seen.add(item_lower)
                 cleaned_content.append(item)
-        
-        return title, '\n\n'.join(cleaned_content)
+        return '\n\n'.join(cleaned_content)
     
-    def find_links(self, html, base_url):
-        """Find all relevant links on a page"""
-        soup = BeautifulSoup(html, 'html.parser')
+    def _find_links(self, doc, base_url):
         links = set()
         
         # Look for links to National 5 Mathematics content
-        # Prioritize links that look like content pages
-        for link in soup.find_all('a', href=True):
+        for link in doc.iter('a'):
             href = link.get('href')
             if not href:
                 continue
@@ -145,7 +415,7 @@ class BBCBitesizeCrawler:
                 normalized_url += f"?{parsed.query}"
             
             # Filter for relevant URLs
-            if self.is_relevant_url(normalized_url):
+            if normalized_url not in links and self.is_relevant_url(normalized_url):
                 links.add(normalized_url)
         
         return links
@@ -158,91 +428,68 @@ class BBCBitesizeCrawler:
         if 'bbc.co.uk/bitesize' not in url_lower and 'bbc.com/bitesize' not in url_lower:
             return False
         
-        # Exclude certain sections that don't contain learning material
-        # BUT keep /revision/ pages as they contain actual learning content
-        exclude_patterns = [
-            '/quizzes/', '/quiz/',  # Quiz pages (we want the actual content)
-            '/games/', '/game/',
-            '/images/', '/image/',
-            '/downloads/', '/download/',
-            '/print/', '/share/',
-            '/search',
-            '/topics?page=',
-            '/articles/',  # Article listings, not content
-            '/videos/', '/video/',  # Video pages (optional - remove if you want videos)
-            '/my-bitesize',
-            '/sign-in',
-            '/register',
-            '/about',
-            '/contact',
-            '/terms',
-            '/privacy',
-            '/cookies',
-            '/accessibility',
-            '/help',
-            '/jobs',
-            '/podcasts',
-            '/radio',
-            '/skillswise',
-            '/external',
-            '?page=',
-            '#',  # Anchors
-        ]
-        # Don't exclude if it's a revision page (they contain learning material)
-        is_revision_page = '/revision/' in url_lower and '/guides/' in url_lower
-        if not is_revision_page and any(pattern in url_lower for pattern in exclude_patterns):
-            return False
-        
-        # Check for National 5 Mathematics subject code (ztrjmp3)
-        has_subject_code = 'ztrjmp3' in url_lower
-        
-        # Check for National 5 and Mathematics keywords
-        n5_keywords = ['national-5', 'national5', 'n5', 'national 5']
-        math_keywords = ['maths', 'mathematics', 'math']
-        
-        has_n5 = any(keyword in url_lower for keyword in n5_keywords)
-        has_math = any(keyword in url_lower for keyword in math_keywords)
-        
-        # Look for content pages - these typically have guides, topics, or revision paths
-        # BBC Bitesize content URLs often look like:
-        # /guides/[code]/revision/[number] - revision material pages
-        # /guides/..., /topics/..., /revision/..., /learn/...
-        has_content_path = any(path in url_lower for path in [
-            '/guides/', '/topics/', '/revision/', '/learn/', '/study/',
-            '/bitesize/guides/', '/bitesize/topics/'
-        ])
-        
         # Specifically check for revision pages (e.g., /guides/z3rqcj6/revision/1)
         # These are important learning material pages
-        has_revision_page = '/revision/' in url_lower and '/guides/' in url_lower
+        is_revision_page = '/revision/' in url_lower and '/guides/' in url_lower
+        # Don't exclude if it's a revision page (they contain learning material)
+        if not is_revision_page and any(pattern in url_lower for pattern in EXCLUDE_PATTERNS):
+            return False
         
         # Include the main subject page and any pages with the subject code
-        if has_subject_code:
+        # (ztrjmp3 is the National 5 Mathematics subject code)
+        if 'ztrjmp3' in url_lower:
             return True
         
         # Include revision pages (they contain actual learning material)
-        if has_revision_page:
+        if is_revision_page:
             return True
         
+        # Check for National 5 and Mathematics keywords
+        has_n5 = any(keyword in url_lower for keyword in N5_KEYWORDS)
+        has_math = any(keyword in url_lower for keyword in MATH_KEYWORDS)
+        
         # Include content pages that are related to National 5 Mathematics
-        if has_content_path and (has_n5 or has_math or has_subject_code):
+        if (has_n5 or has_math) and any(path in url_lower for path in CONTENT_PATHS):
             return True
         
         # Include pages that clearly mention National 5 and Mathematics
-        if has_n5 and has_math:
-            return True
-        
-        return False
+        return has_n5 and has_math
+    
+    def format_page(self, title, content, url):
+        """Text of a saved page: a URL/Title header followed by the content"""
+        return f"URL: {url}\nTitle: {title}\n{'=' * 80}\n\n{content}"
     
-    def save_content(self, title, content, url):
-        """Save scraped content to a file"""
+    def save_content(self, title, content, url, filename=None):
+        """Save scraped content to a file; returns the filename, or None if nothing was saved
+        
+        If filename is given (the page was saved by an earlier crawl) that file is
+        overwritten instead of creating a new one. Saved pages are also sent to
+        the index pipeline, if there is one.
+        """
         if not content or len(content.strip()) < 50:
-            return False
+            return None
+        
+        # newline='' writes the text byte for byte, so the index pipeline can hash it without re-reading
+        text = self.format_page(title, content, url)
+        if filename:
+            filepath = self.output_dir / filename
+            try:
+                with open(filepath, 'w', encoding='utf-8', newline='') as f:
+                    f.write(text)
+                print(f"Updated: {filepath.name}")
+                with self.lock:
+                    self.scraped_count += 1
+                if self.pipeline:
+                    self.pipeline.put(filename, text)
+                return filename
+            except Exception as e:
+                print(f"Error saving {filepath}: {e}")
+                return None
         
         # Create a safe filename from title or URL
         if title:
-            filename = re.sub(r'[^\w\s-]', '', title)[:100]
-            filename = re.sub(r'[-\s]+', '-', filename)
+            filename = UNSAFE_FILENAME_RE.sub('', title)[:100]
+            filename = FILENAME_SEPARATOR_RE.sub('-', filename)
         else:
             # Use URL path as filename
             parsed = urlparse(url)
@@ -254,108 +501,203 @@ class BBCBitesizeCrawler:
         filename = f"{filename}.txt"
         filepath = self.output_dir / filename
         
-        # Avoid overwriting - add number if exists
+        # Avoid overwriting - add number if exists. Opening with 'x' fails if the
+        # file exists, so two workers can never claim the same name
         counter = 1
         original_filepath = filepath
-        while filepath.exists():
-            stem = original_filepath.stem
-            filepath = self.output_dir / f"{stem}_{counter}.txt"
-            counter += 1
-        
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(f"URL: {url}\n")
-                f.write(f"Title: {title}\n")
-                f.write("=" * 80 + "\n\n")
-                f.write(content)
+            while True:
+                try:
+                    f = open(filepath, 'x', encoding='utf-8', newline='')
+                    break
+                except FileExistsError:
+                    stem = original_filepath.stem
+                    filepath = self.output_dir / f"{stem}_{counter}.txt"
+                    counter += 1
+            with f:
+                f.write(text)
             print(f"Saved: {filepath.name}")
-            self.scraped_count += 1
-            return True
+            with self.lock:
+                self.scraped_count += 1
+            if self.pipeline:
+                self.pipeline.put(filepath.name, text)
+            return filepath.name
         except Exception as e:
             print(f"Error saving {filepath}: {e}")
-            return False
+            return None
+    
+    def process_page(self, url):
+        """Fetch, extract and save one page; returns the relevant links found, or None if the fetch failed
+        
+        Pages unchanged since the last crawl (a 304, or the same content hash)
+        are not saved again.
+        """
+        response = self.fetch_page(url)
+        
+        if response is None:
+            print(f"  → Failed to fetch page: {url}")
+            return None
+        
+        record = self.pages.get(url)
+        if response.status_code == 304:
+            # Not modified: reuse the links found last time without parsing anything
+            print(f"  → Not modified: {url}")
+            with self.lock:
+                self.unchanged_count += 1
+            return set(record['links'])
+        
+        html = response.text
+        
+        # Extract content and new links from a single parse
+        title, content, links = self.parse_page(html, url)
+        
+        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest() if content else None
+        filename = record['filename'] if record else None
+        duplicate_of = None
+        if record and record['content_hash'] == content_hash and (not filename or (self.output_dir / filename).exists()):
+            print(f"  → Unchanged: {url}")
+            with self.lock:
+                self.unchanged_count += 1
+            duplicate_of = record.get('duplicate_of')
+        elif content and len(content.strip()) > 100:  # Only save substantial content
+            page_signature = signature(content)
+            with self.duplicate_lock:
+                duplicate_of = self.duplicates.find(page_signature, exclude=filename)
+                if duplicate_of is None:
+                    filename = self.save_content(title, content, url, filename=filename)
+                    if filename:
+                        self.duplicates.add(filename, page_signature)
+            if duplicate_of:
+                print(f"  → Near-duplicate of {duplicate_of}, skipping")
+                with self.lock:
+                    self.duplicate_count += 1
+            elif filename:
+                print(f"  → Saved: {title[:60]}...")
+            else:
+                print(f"  → Content too short, skipping")
+        else:
+            print(f"  → No substantial content found: {url}")
+        
+        with self.lock:
+            self.pages[url] = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'content_hash': content_hash,
+                'filename': filename,
+                'duplicate_of': duplicate_of,
+                'links': sorted(links),
+            }
+        return links
     
-    def crawl(self, start_urls=None, max_pages=200):
-        """Main crawling function"""
+    def crawl(self, start_urls=None, max_pages=200, workers=None, resume=False):
+        """Main crawling function
+        
+        Up to `workers` pages are fetched and processed at once; the per-host
+        rate limiter still bounds how fast requests reach the server. The crawl
+        is checkpointed every CHECKPOINT_EVERY pages and when it stops; with
+        resume=True it carries on from the last checkpoint.
+        """
         if start_urls is None:
             # Default start URLs for National 5 Mathematics
             # ztrjmp3 is BBC's subject code for National 5 Mathematics
             start_urls = [
                 "https://www.bbc.co.uk/bitesize/subjects/ztrjmp3",  # National 5 Mathematics main page
             ]
-        
-        to_visit = list(start_urls)
-        pages_crawled = 0
+        workers = workers or self.workers
+        
+        frontier = CrawlFrontier()
+        state = self.load_state() if resume else None
+        if state and state["frontier"]:
+            self.visited_urls = set(state["visited"])
+            self.scraped_count = state["scraped_count"]
+            for url in self.visited_urls:
+                frontier.mark_seen(url)
+            for url, depth in state["frontier"]:
+                frontier.push(url, depth)
+            print(f"Resuming crawl: {len(self.visited_urls)} pages already crawled, {len(frontier)} queued")
+        else:
+            for url in start_urls:
+                frontier.push(url, depth=0)
+        pages_crawled = len(self.visited_urls)
+        started_from = pages_crawled
+        started = time.perf_counter()
         
         print(f"Starting crawl with {len(start_urls)} starting URLs")
         print(f"Maximum pages to crawl: {max_pages}")
+        print(f"Workers: {workers}, rate limit: {self.requests_per_second} requests/sec per host")
         print(f"Target URL: {start_urls[0]}")
         print("-" * 80)
         
-        while to_visit and pages_crawled < max_pages:
-            url = to_visit.pop(0)
-            
-            if url in self.visited_urls:
-                continue
-            
-            print(f"\n[{pages_crawled + 1}/{max_pages}] Crawling: {url}")
-            html = self.fetch_page(url)
-            
-            if not html:
-                print("  → Failed to fetch page")
-                continue
-            
-            # Extract content
-            title, content = self.extract_content(html, url)
-            
-            if content and len(content.strip()) > 100:  # Only save substantial content
-                saved = self.save_content(title, content, url)
-                if saved:
-                    print(f"  → Saved: {title[:60]}...")
-                else:
-                    print(f"  → Content too short, skipping")
-            else:
-                print(f"  → No substantial content found")
-            
-            # Find new links
-            new_links = self.find_links(html, url)
-            print(f"  → Found {len(new_links)} relevant links")
-            
-            # Add new links to queue (prioritize content pages)
-            # Prioritize revision pages first (they contain the actual learning material)
-            revision_links = [l for l in new_links if '/revision/' in l.lower() and '/guides/' in l.lower()]
-            content_links = [l for l in new_links if any(path in l.lower() for path in ['/guides/', '/topics/']) and l not in revision_links]
-            other_links = [l for l in new_links if l not in revision_links and l not in content_links]
-            
-            # Add revision links first (highest priority - actual learning material)
-            for link in revision_links:
-                if link not in self.visited_urls and link not in to_visit:
-                    to_visit.append(link)
-            
-            # Then add other content links (guides, topics)
-            for link in content_links:
-                if link not in self.visited_urls and link not in to_visit:
-                    to_visit.append(link)
-            
-            # Then add other relevant links
-            for link in other_links:
-                if link not in self.visited_urls and link not in to_visit:
-                    to_visit.append(link)
-            
-            pages_crawled += 1
-        
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            in_flight = {}
+            try:
+                while (frontier or in_flight) and pages_crawled < max_pages:
+                    # Keep every worker busy, but never start more pages than the budget allows.
+                    # Revision pages come first, then guides/topics, then the rest, shallowest first
+                    while frontier and len(in_flight) < workers and pages_crawled + len(in_flight) < max_pages:
+                        url, depth = frontier.pop()
+                        if url in self.visited_urls:
+                            continue
+                        in_flight[pool.submit(self.process_page, url)] = (url, depth)
+                    if not in_flight:
+                        break
+                    
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        url, depth = in_flight.pop(future)
+                        try:
+                            new_links = future.result()
+                        except Exception as e:
+                            print(f"  → Error processing {url}: {e}")
+                            continue
+                        if new_links is None:
+                            continue
+                        
+                        pages_crawled += 1
+                        print(f"\n[{pages_crawled}/{max_pages}] Crawled: {url}")
+                        print(f"  → Found {len(new_links)} relevant links")
+                        
+                        queued = sum(frontier.push(link, depth + 1) for link in new_links)
+                        print(f"  → Queued {queued} new links ({len(frontier)} waiting)")
+                        
+                        if pages_crawled % CHECKPOINT_EVERY == 0:
+                            self.save_state(frontier, in_flight.values())
+            finally:
+                # Also reached on Ctrl+C, so the crawl can be resumed with --resume
+                self.save_state(frontier, in_flight.values())
+        
+        elapsed = time.perf_counter() - started
         print("\n" + "=" * 80)
         print(f"Crawl completed!")
         print(f"Total pages visited: {len(self.visited_urls)}")
         print(f"Total files saved: {self.scraped_count}")
+        print(f"Unchanged since last crawl: {self.unchanged_count}")
+        print(f"Near-duplicates skipped: {self.duplicate_count}")
+        print(f"Elapsed: {elapsed:.1f}s ({(pages_crawled - started_from) / elapsed if elapsed else 0:.2f} pages/sec)")
         print(f"Files saved in: {self.output_dir.absolute()}")
 
 def main():
     """Main entry point"""
+    parser = argparse.ArgumentParser(description="Crawl BBC Bitesize National 5 Mathematics into docs/")
+    parser.add_argument("--max-pages", type=int, default=200, help="pages to crawl")
+    parser.add_argument("--workers", type=int, default=4, help="pages fetched and processed in parallel")
+    parser.add_argument("--rate", type=float, default=1.0, help="requests per second per host")
+    parser.add_argument("--burst", type=int, default=1, help="requests allowed back to back per host")
+    parser.add_argument("--resume", action="store_true", help="continue the last interrupted crawl from its checkpoint")
+    parser.add_argument("--index", action="store_true", help="embed pages into the vector index while crawling")
+    args = parser.parse_args()
+    
     print("BBC Bitesize National 5 Mathematics Web Crawler")
     print("=" * 80)
     
-    crawler = BBCBitesizeCrawler(output_dir="docs")
+    pipeline = IndexPipeline("docs") if args.index else None
+    crawler = BBCBitesizeCrawler(
+        output_dir="docs",
+        requests_per_second=args.rate,
+        burst=args.burst,
+        workers=args.workers,
+        pipeline=pipeline
+    )
     
     # You can customize these URLs or add more
     start_urls = [
@@ -363,7 +705,12 @@ def main():
     ]
     
     # Crawl with a reasonable limit (increased to get more content)
-    crawler.crawl(start_urls=start_urls, max_pages=200)
+    try:
+        crawler.crawl(start_urls=start_urls, max_pages=args.max_pages, resume=args.resume)
+    finally:
+        if pipeline:
+            print("Waiting for the last pages to be indexed...")
+            pipeline.close()
     
     print("\nNote: Please respect BBC's robots.txt and terms of service.")
     print("This crawler includes rate limiting to be respectful to their servers.")